@@ -1,7 +1,9 @@
 #----------------------------------------------------------------------------#
 # Imports
 #----------------------------------------------------------------------------#
+import itertools
 import json
+import sys
 import dateutil.parser
 import babel
 from flask import (
@@ -11,16 +13,45 @@ from flask import (
   Response, 
   flash, 
   redirect, 
-  url_for
+  url_for,
+  jsonify,
+  stream_with_context,
+  get_flashed_messages
   )
 from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
+from sqlalchemy import literal
+from werkzeug.datastructures import MultiDict
+from werkzeug.middleware.proxy_fix import ProxyFix
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy_utils import PhoneNumber
+from phonenumbers import NumberParseException
 import logging
 from logging import Formatter, FileHandler
 from flask_wtf import Form
 from forms import *
 from models import *
+import events
+import fragment_cache
+import autocomplete
+import invalidation
+import routing
+from routing import read_only
+import limits
+import metrics
+import profiling
+import slow_queries
+import dashboard
+import search_cache
+import compression
+import static_export
+import outbox
+import matching
+import dedupe
+import reports
+import show_stream
+import snapshot
+import lookups
 
 #----------------------------------------------------------------------------#
 # App Config.
@@ -29,11 +60,61 @@ from models import *
 app = Flask(__name__)
 moment = Moment(app)
 app.config.from_object('config')
-db = SQLAlchemy(app)
+db.init_app(app)
+#bind it for the engine and background work outside of requests
+db.app = app
 
 #connect to a local postgresql database
 migrate = Migrate(app, db)
 
+#send read-only requests to the replicas, if any are configured
+replicas = routing.init_app(app)
+
+#request, SQL, pool and template timings at /metrics
+metrics.init_app(app, [db.engine] + replicas.engines)
+
+#log statements over SLOW_QUERY_SECONDS, with sampled EXPLAIN plans
+slow_queries.init_app(app, [db.engine] + replicas.engines)
+
+#gzip/brotli for the HTML and JSON responses, see COMPRESS_* in config.py
+compression.init_app(app)
+
+#opt-in request profiling, see PROFILE_* in config.py
+profiling.init_app(app)
+
+#behind load balancers the client is in X-Forwarded-For; the rate limits
+#key on it, see TRUSTED_PROXIES in config.py
+if app.config.get('TRUSTED_PROXIES'):
+  app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'])
+
+#reject bursts on the expensive routes early, see RATE_LIMITS in config.py
+limiter = limits.init_app(app)
+
+#publish committed writes to the caches below
+events.track_changes(db.session)
+fragment_cache.init_app(app)
+name_index = autocomplete.init_app(app, db, {'venues': Venue, 'artists': Artist})
+show_ids = lookups.init_app(app, db, {'venues': Venue, 'artists': Artist})
+home_dashboard = dashboard.init_app(app, db, Venue, Artist, Show)
+searches = search_cache.init_app(app)
+match_index = matching.init_app(app, db, Venue, Artist, Show)
+
+#change feed for mirrors at /api/v1/changes
+outbox.init_app(app, db, ChangeEvent)
+#monthly rollups behind /reports, counted as shows are written
+reports.init_app(app, db, Venue, Artist, Show, ShowRollup, GenreRollup)
+#one fan-out of show writes per worker for the /shows/stream clients
+show_feed = show_stream.init_app(app, db, Venue, Artist, Show)
+
+#`flask export-static` writes the public pages out for a CDN
+static_export.init_app(app, db, Venue, Artist, Show)
+#`flask dedupe` / `flask merge` for near-duplicate venues and artists
+dedupe.init_app(app, db, Venue, Artist, Show)
+#`flask snapshot-sqlite` for the read-only edge nodes
+snapshot.init_app(app, db)
+if app.config.get('INVALIDATION_BUS'):
+  invalidation.init_app(app, db)
+
 
 #----------------------------------------------------------------------------#
 # Filters.
@@ -49,54 +130,187 @@ def format_datetime(value, format='medium'):
 
 app.jinja_env.filters['datetime'] = format_datetime
 
+#----------------------------------------------------------------------------#
+# Streaming.
+#----------------------------------------------------------------------------#
+
+def stream_template(template_name, **context):
+  # like render_template, but sends the page while the template iterates
+  # over its rows; pair with yield_per queries so neither the rows nor the
+  # HTML are ever held in memory all at once
+  app.update_template_context(context)
+  # pop the flashed messages now, while the session cookie can still be
+  # updated; the layout gets the same messages from the request context
+  get_flashed_messages()
+  template = app.jinja_env.get_template(template_name)
+  stream = template.stream(context)
+  stream.enable_buffering(app.config.get('STREAM_BUFFER_ITEMS', 50))
+  return Response(stream_with_context(stream), mimetype='text/html')
+
+
+def likely_duplicates(model, form):
+  # best-effort: a failing check must never cost the insert itself
+  try:
+    return dedupe.similar(
+      db, model, form.name.data, form.city.data, form.state.data,
+      threshold=app.config.get('DEDUPE_THRESHOLD', 0.5)
+    )
+  except Exception as e:
+    db.session.rollback()
+    print(f'Duplicate check failed -- {e}')
+    return []
+
+
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
 
 @app.route('/')
 def index():
-  return render_template('pages/home.html')
+  # the activity panels come from a snapshot refreshed in the background
+  return render_template('pages/home.html', dashboard=home_dashboard.snapshot)
+
+
+@app.route('/autocomplete')
+def autocomplete_names():
+  # typeahead for the search boxes, answered from the in-memory name index
+  q=request.args.get('q', '')
+  kind=request.args.get('type')
+  if kind not in (None, 'venues', 'artists'):
+    return jsonify({'error': 'type must be venues or artists'}), 400
+  limit=min(request.args.get('limit', 10, type=int), 50)
+
+  return jsonify({'data': name_index.search(q, entity=kind, limit=limit)})
+
+
+@app.route('/limits')
+def limit_stats():
+  # requests turned away by the rate limits and concurrency caps
+  return jsonify({'rejected': limiter.stats()})
+
+
+@app.route('/matches')
+def show_matches():
+  # seeking venues and artists with their best counterparts in the same
+  # city, ranked by shared genres then recent shows (see matching.py)
+  city=request.args.get('city')
+  state=request.args.get('state')
+  limit=app.config.get('MATCH_LIMIT', 5)
+
+  data={}
+  for kind in ('venues', 'artists'):
+    data[kind]=[{
+      'id': entry['id'],
+      'name': entry['name'],
+      'city': entry['city'],
+      'state': entry['state'],
+      'genres': sorted(entry['genres']),
+      'matches': [{
+        'id': match['id'],
+        'name': match['name'],
+        'shared_genres': shared,
+        'recent_shows': activity,
+      } for match, shared, activity in match_index.matches(kind, entry['id'], limit)],
+    } for entry in match_index.seeking(kind, city, state)]
+
+  if request.args.get('format') == 'json':
+    return jsonify(data)
+  return render_template('pages/matches.html', venues=data['venues'], artists=data['artists'], city=city, state=state)
+
+
+# ----------------------------------------------------------------- 
+# Search
+# ----------------------------------------------------------------- 
 
+# results are cached per normalized term (see search_cache.py), so only
+# ids and names are loaded
+
+def find_venues(term):
+  return [
+    {'id': id, 'name': name} for id, name in
+      db.session.query(Venue.id, Venue.name).filter(Venue.name.ilike(f'%{term}%'))
+  ]
+
+def find_artists(term):
+  return [
+    {'id': id, 'name': name} for id, name in
+      db.session.query(Artist.id, Artist.name).filter(Artist.name.ilike(f'%{term}%'))
+  ]
+
+def find_everything(term):
+  # venues and artists in one round trip
+  pattern=f'%{term}%'
+  venues=db.session.query(literal('venues', db.String), Venue.id, Venue.name). \
+    filter(Venue.name.ilike(pattern))
+  artists=db.session.query(literal('artists', db.String), Artist.id, Artist.name). \
+    filter(Artist.name.ilike(pattern))
+
+  results={'venues': [], 'artists': []}
+  for kind, id, name in venues.union_all(artists):
+    results[kind].append({'id': id, 'name': name})
+  return results
+
+@app.route('/search', methods=['POST'])
+@limiter.limit('search')
+@read_only
+def search():
+  search=search_cache.normalize(request.form.get('search_term'))
+  venues=searches.get('venues', search)
+  artists=searches.get('artists', search)
+  if venues is None or artists is None:
+    results=find_everything(search)
+    venues, artists=results['venues'], results['artists']
+    searches.set('venues', search, venues)
+    searches.set('artists', search, artists)
+
+  return render_template(
+    'pages/search.html',
+    venues={'count': len(venues), 'data': venues},
+    artists={'count': len(artists), 'data': artists},
+    search_term=request.form.get('search_term', '')
+  )
 
 # ----------------------------------------------------------------- 
 # Venues
 #  ----------------------------------------------------------------
 
 @app.route('/venues')
+@read_only
 def venues():
+  # venues arrive ordered by area from a server-side cursor, so only one
+  # area's venues are in memory at a time
+  rows=(
+    db.session.query(Venue.city, Venue.state, Venue.id, Venue.name). \
+      order_by(Venue.city, Venue.state, Venue.name). \
+      yield_per(app.config.get('STREAM_YIELD_PER', 1000))
+    )
+
+  data=(
+    {
+      'city':city,
+      'state':state,
+      'venues':[{'id':id, 'name':name} for _, _, id, name in area]
+    }
+    for (city, state), area in itertools.groupby(rows, key=lambda row: (row.city, row.state))
+  )
 
-  data=[]
-  venues=Venue.query.all()
-  places=Venue.query.distinct(Venue.city, Venue.state).all()
-
-  for place in places:
-    data.append({
-      'city':place.city,
-      'state':place.state,
-      'venues':[
-        {
-        'id':venue.id,
-        'name':venue.name,
-        } 
-        for venue in venues if
-          venue.city==place.city and venue.state ==place.state
-      ]
-    })
-
-  return render_template('pages/venues.html', areas=data)
+  return stream_template('pages/venues.html', areas=data)
 
 @app.route('/venues/search', methods=['POST'])
+@limiter.limit('search')
+@read_only
 def search_venues():
   # implement search on artists with partial string search. Ensure it is case-insensitive.
   # seach for Hop should return "The Musical Hop".
   # search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
-  search=request.form.get('search_term')
-  venues=Venue.query.filter(Venue.name.ilike(f"%{search}%")).all()
+  search=search_cache.normalize(request.form.get('search_term'))
+  venues=searches.fetch('venues', search, find_venues)
   response={'count':len(venues),'data':venues}
 
   return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
 
 @app.route('/venues/<int:venue_id>')
+@read_only
 def show_venue(venue_id):
   # shows the venue page with the given venue_id
   venue=Venue.query.filter_by(id=venue_id).first_or_404()
@@ -163,9 +377,12 @@ def create_venue_form():
   return render_template('forms/new_venue.html', form=form)
 
 @app.route('/venues/create', methods=['POST'])
+@limiter.limit('write')
 def create_venue_submission():
   error=False
   form = VenueForm(request.form)
+  #likely duplicates in the same city, to warn about below
+  duplicates=likely_duplicates(Venue, form)
   try:
       venue=Venue()
       form.populate_obj(venue)
@@ -189,10 +406,16 @@ def create_venue_submission():
   else:
     # on successful db insert, flash success
     flash('Venue ' + request.form['name'] + ' was successfully listed!')
+    if duplicates:
+      flash(
+        f'Venue {request.form["name"]} looks like a duplicate of '
+        + ', '.join(f'{name} (#{id})' for score, id, name in duplicates)
+      )
 
   return render_template('pages/home.html')
 
 @app.route('/venues/<venue_id>', methods=['DELETE'])
+@limiter.limit('write')
 def delete_venue(venue_id):
   error=False
   venue=Venue.query.get(venue_id)
@@ -222,24 +445,32 @@ def delete_venue(venue_id):
 #  Artists
 #  ----------------------------------------------------------------
 @app.route('/artists')
+@read_only
 def artists():
-  #artists query
-  data=Artist.query.all()
+  #artists query, streamed through a server-side cursor
+  data=(
+    db.session.query(Artist.id, Artist.name). \
+      order_by(Artist.name). \
+      yield_per(app.config.get('STREAM_YIELD_PER', 1000))
+    )
  
-  return render_template('pages/artists.html', artists=data)
+  return stream_template('pages/artists.html', artists=data)
 
 @app.route('/artists/search', methods=['POST'])
+@limiter.limit('search')
+@read_only
 def search_artists():
   # implement search on artists with partial string search. Ensure it is case-insensitive.
   # seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
   # search for "band" should return "The Wild Sax Band".
-  search=request.form.get('search_term')
-  artists=Artist.query.filter(Artist.name.ilike(f'%{search}%')).all()
+  search=search_cache.normalize(request.form.get('search_term'))
+  artists=searches.fetch('artists', search, find_artists)
   response={'count':len(artists),'data':artists}
 
   return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
 
 @app.route('/artists/<int:artist_id>')
+@read_only
 def show_artist(artist_id):
   # shows the venue page with the given venue_id
   curr_date = datetime.now()
@@ -300,9 +531,43 @@ def show_artist(artist_id):
 
 #  Update
 #  ----------------------------------------------------------------
+
+# columns the edit forms may change
+artist_edit_fields=['name', 'city', 'state', 'phone', 'genres', 'facebook_link']
+venue_edit_fields=[
+  'name', 'genres', 'address', 'city', 'state', 'phone', 'website',
+  'facebook_link', 'seeking_talent', 'seeking_description', 'image_link'
+  ]
+
+def e164(phone):
+  #phone numbers are stored as E.164 strings, '' when unset; the form gives
+  #a PhoneNumber, older rows may hold them as typed
+  if not phone:
+    return ''
+  if not isinstance(phone, PhoneNumber):
+    try:
+      phone=PhoneNumber(phone, 'US')
+    except NumberParseException:
+      return phone
+  return phone.e164
+
+def apply_form(obj, form, fields):
+  # assign only what the editor actually changed, so the UPDATE touches
+  # just those columns and an unchanged submission doesn't bump the version
+  changed=False
+  for field in fields:
+    value=getattr(form, field).data
+    current=getattr(obj, field)
+    if field=='phone':
+      value, current=e164(value), e164(current)
+    if current != value:
+      setattr(obj, field, value)
+      changed=True
+  return changed
+
 @app.route('/artists/<int:artist_id>/edit', methods=['GET'])
 def edit_artist(artist_id):
-  artist=Artist.query.get(artist_id)  
+  artist=Artist.query.get_or_404(artist_id)
   form = ArtistForm()
   #prepopulate form with the artist data
   form.name.data = artist.name
@@ -311,31 +576,36 @@ def edit_artist(artist_id):
   form.phone.data = artist.phone
   form.genres.data = artist.genres
   form.facebook_link.data = artist.facebook_link
+  #the version the editor started from, checked again on submit
+  form.version_id.data = artist.version_id
   
-  return render_template('forms/edit_artist.html', form=form, artist=artists)
+  return render_template('forms/edit_artist.html', form=form, artist=artist)
 
 @app.route('/artists/<int:artist_id>/edit', methods=['POST'])
+@limiter.limit('write')
 def edit_artist_submission(artist_id):
   # take values from the form submitted, and update existing
   # artist record with ID <artist_id> using the new attributes
   error=False
+  conflict=False
   
-  artist=Artist.query.get(artist_id)
+  artist=Artist.query.get_or_404(artist_id)
   form=ArtistForm(request.form)
+  name=form.name.data
   
   if form.validate():
 
     try:
-      artist.name=form.name.data
-      artist.city=form.city.data
-      artist.state=form.state.data
-      artist.phone=form.phone.data 
-      artist.genres=form.genres.data
-      artist.facebook_link=form.facebook_link.data
-
-      # Artist.update(artist)
-      db.session.commit()
+      if form.version_id.data != str(artist.version_id):
+        conflict=True
+      elif apply_form(artist, form, artist_edit_fields):
+        # the UPDATE is guarded by version_id, so a concurrent edit
+        # committed since the check above raises StaleDataError
+        db.session.commit()
     
+    except StaleDataError:
+      conflict=True
+      db.session.rollback()
     except Exception as e:
       error=True
       print(f'Exception occured -- {e}')
@@ -343,21 +613,30 @@ def edit_artist_submission(artist_id):
       db.session.rollback()
     finally:
       db.session.close()
+
+  if conflict:
+    flash(
+      f'Artist {name} was changed by someone else while you were editing. '
+      'Review the current details and submit again.'
+    )
+    artist=Artist.query.get_or_404(artist_id)
+    form=ArtistForm(formdata=None, obj=artist)
+    return render_template('forms/edit_artist.html', form=form, artist=artist), 409
   
   if error:
     flash(
       f'An error occured during update'
-      f'Artist {artist.name} could not be updated'
+      f'Artist {name} could not be updated'
       f'{form.errors}'
     )
   else:
-    flash(f'Artist {artist.name} was successfully updated!')
+    flash(f'Artist {name} was successfully updated!')
   
   return redirect(url_for('show_artist', artist_id=artist_id))
 
 @app.route('/venues/<int:venue_id>/edit', methods=['GET'])
 def edit_venue(venue_id):
-  venue=Venue.query.get(venue_id)
+  venue=Venue.query.get_or_404(venue_id)
   form = VenueForm()
 
   form.name.data =  venue.name
@@ -371,36 +650,33 @@ def edit_venue(venue_id):
   form.seeking_talent.data =  venue.seeking_talent
   form.seeking_description.data =  venue.seeking_description
   form.image_link.data =  venue.image_link
+  form.version_id.data = venue.version_id
 
   return render_template('forms/edit_venue.html', form=form, venue=venue)
 
 @app.route('/venues/<int:venue_id>/edit', methods=['POST'])
+@limiter.limit('write')
 def edit_venue_submission(venue_id):
   # take values from the form submitted, and update existing
   # venue record with ID <venue_id> using the new attributes
   error=False
+  conflict=False
   
-  venue=Venue.query.get(venue_id)
+  venue=Venue.query.get_or_404(venue_id)
   form=VenueForm(request.form)
+  name=form.name.data
   
   if form.validate():
 
     try:
-      venue.name = form.name.data
-      venue.genres = form.genres.data 
-      venue.address = form.address.data 
-      venue.city = form.city.data 
-      venue.state = form.state.data 
-      venue.phone = form.phone.data 
-      venue.website = form.website.data 
-      venue.facebook_link = form.facebook_link.data 
-      venue.seeking_talent  =  form.seeking_talent.data
-      venue.seeking_description  = form.seeking_description.data 
-      venue.image_link =  form.image_link.data 
-
-      # Venue.update(venue)
-      db.session.commit()
+      if form.version_id.data != str(venue.version_id):
+        conflict=True
+      elif apply_form(venue, form, venue_edit_fields):
+        db.session.commit()
     
+    except StaleDataError:
+      conflict=True
+      db.session.rollback()
     except Exception as e:
       error=True
       print(f'Exception occured -- {e}')
@@ -408,15 +684,24 @@ def edit_venue_submission(venue_id):
       db.session.rollback()
     finally:
       db.session.close()
+
+  if conflict:
+    flash(
+      f'Venue {name} was changed by someone else while you were editing. '
+      'Review the current details and submit again.'
+    )
+    venue=Venue.query.get_or_404(venue_id)
+    form=VenueForm(formdata=None, obj=venue)
+    return render_template('forms/edit_venue.html', form=form, venue=venue), 409
   
   if error:
     flash(
       f'An error occured during update'
-      f'Artist {venue.name} could not be updated'
+      f'Venue {name} could not be updated'
       f'{form.errors}'
     )
   else:
-    flash(f'Artist {venue.name} was successfully updated!')
+    flash(f'Venue {name} was successfully updated!')
   
   return redirect(url_for('show_venue', venue_id=venue_id))
 
@@ -429,11 +714,14 @@ def create_artist_form():
   return render_template('forms/new_artist.html', form=form)
 
 @app.route('/artists/create', methods=['POST'])
+@limiter.limit('write')
 def create_artist_submission():
   # called upon submitting the new artist listing form --works
   error=False
 
   form=ArtistForm(request.form)
+  #likely duplicates in the same city, to warn about below
+  duplicates=likely_duplicates(Artist, form)
   try:
       artist=Artist()
       form.populate_obj(artist)
@@ -457,6 +745,11 @@ def create_artist_submission():
   else:
     # on successful db insert, flash success
     flash('Artist ' + request.form['name'] + ' was successfully listed!')
+    if duplicates:
+      flash(
+        f'Artist {request.form["name"]} looks like a duplicate of '
+        + ', '.join(f'{name} (#{id})' for score, id, name in duplicates)
+      )
 
   return render_template('pages/home.html')
 
@@ -465,17 +758,57 @@ def create_artist_submission():
 #  ----------------------------------------------------------------
 
 @app.route('/shows')
+@read_only
 def shows():
   # displays list of shows at /shows
-  shows=Show.query.all()
-  for show in shows:
-    show.venue_name = Venue.query.get(show.venue_id).name
-    artist =Artist.query.get(show.artist_id)
-    show.artist_name=artist.name
-    show.artist_image_link=artist.image_link
-    show.start_time=str(show.start_time)
+  # one joined query instead of two lookups per show, streamed from a
+  # server-side cursor; the tiles themselves come from the fragment cache
+  rows=(
+    db.session.query(
+      Show.id, Show.venue_id, Show.artist_id, Show.start_time,
+      Artist.name, Artist.image_link, Venue.name
+    ). \
+      join(Artist, Show.artist_id == Artist.id). \
+      join(Venue, Show.venue_id == Venue.id). \
+      order_by(Show.start_time). \
+      yield_per(app.config.get('STREAM_YIELD_PER', 1000))
+    )
+
+  data=({
+    'id': id,
+    'venue_id': venue_id,
+    'venue_name': venue_name,
+    'artist_id': artist_id,
+    'artist_name': artist_name,
+    'artist_image_link': artist_image_link,
+    'start_time': str(start_time),
+  } for id, venue_id, artist_id, start_time, artist_name, artist_image_link, venue_name in rows)
+
+  return stream_template('pages/shows.html', shows=data)
+
+@app.route('/shows/stream')
+def stream_shows():
+  # server-sent events of new and changed upcoming shows for the kiosks,
+  # optionally only for a city, state or genre; fed from the shared
+  # fan-out, so an open stream never touches the database
+  client=show_feed.subscribe(
+    city=request.args.get('city'),
+    state=request.args.get('state'),
+    genre=request.args.get('genre'),
+    #resume after the last event the browser saw, see show_stream.py
+    last_event_id=request.headers.get('Last-Event-ID'),
+  )
+  if client is None:
+    return jsonify({'error': 'too many open streams, try again later'}), 503, {'Retry-After': '30'}
 
-  return render_template('pages/shows.html', shows=shows)
+  response=Response(
+    show_feed.stream(client, heartbeat=app.config.get('SHOW_STREAM_HEARTBEAT', 15)),
+    mimetype='text/event-stream'
+  )
+  response.headers['Cache-Control']='no-cache'
+  # tell nginx not to buffer the events
+  response.headers['X-Accel-Buffering']='no'
+  return response
 
 @app.route('/shows/create')
 def create_shows():
@@ -484,6 +817,7 @@ def create_shows():
   return render_template('forms/new_show.html', form=form)
 
 @app.route('/shows/create', methods=['POST'])
+@limiter.limit('write')
 def create_show_submission():
   # called to create new shows in the db, upon submitting new show listing form
   error = False
@@ -491,6 +825,13 @@ def create_show_submission():
   format = '%Y-%m-%d %H:%M:%S'
   
   form=ShowForm(request.form)
+  # unknown artist / venue ids are caught here, not by the commit
+  if not form.validate():
+    flash('Show could not be listed: ' + '; '.join(
+      error for errors in form.errors.values() for error in errors
+    ))
+    return render_template('forms/new_show.html', form=form), 400
+
   try:
       show = Show()
       form.populate_obj(show)
@@ -516,6 +857,82 @@ def create_show_submission():
 
   return render_template('pages/home.html')
 
+#  Bulk shows
+#  ----------------------------------------------------------------
+
+def parse_show_lines(text):
+  # "artist id, venue id, start time" per line -> (line number, ShowForm)
+  forms=[]
+  for number, line in enumerate(text.splitlines(), 1):
+    if not line.strip():
+      continue
+    fields=[field.strip() for field in line.split(',', 2)] + ['', '']
+    forms.append((number, ShowForm(
+      formdata=MultiDict({
+        'artist_id': fields[0],
+        'venue_id': fields[1],
+        'start_time': fields[2],
+      }),
+      # the surrounding BulkShowForm carries the CSRF token
+      meta={'csrf': False},
+    )))
+  return forms
+
+def id_values(forms, name):
+  return {form[name].data for number, form in forms if isinstance(form[name].data, int)}
+
+@app.route('/shows/bulk', methods=['GET'])
+def create_shows_bulk_form():
+  form = BulkShowForm()
+  return render_template('forms/bulk_shows.html', form=form, errors=[])
+
+@app.route('/shows/bulk', methods=['POST'])
+@limiter.limit('write')
+def create_shows_bulk_submission():
+  form = BulkShowForm(request.form)
+  if not form.validate():
+    return render_template('forms/bulk_shows.html', form=form, errors=[]), 400
+
+  rows = parse_show_lines(form.shows.data)
+  if len(rows) > app.config.get('BULK_SHOWS_MAX', 500):
+    flash(f'At most {app.config.get("BULK_SHOWS_MAX", 500)} shows at a time')
+    return render_template('forms/bulk_shows.html', form=form, errors=[]), 400
+
+  # one IN (...) query per entity for the ids not cached yet; the row
+  # validators below then only read the cache
+  for entity, name in (('artists', 'artist_id'), ('venues', 'venue_id')):
+    show_ids.prefetch(entity, id_values(rows, name))
+
+  errors=[]
+  for number, row in rows:
+    if not row.validate():
+      errors.append((number, [error for field_errors in row.errors.values() for error in field_errors]))
+  if errors:
+    flash(f'{len(errors)} of {len(rows)} lines have errors, no shows were listed')
+    return render_template('forms/bulk_shows.html', form=form, errors=errors), 400
+
+  error=False
+  try:
+    shows=[]
+    for number, row in rows:
+      show = Show()
+      row.populate_obj(show)
+      shows.append(show)
+    db.session.add_all(shows)
+    db.session.commit()
+  except Exception as e:
+    error=True
+    db.session.rollback()
+    print(f'Exception ==> {e}')
+  finally:
+    db.session.close()
+
+  if error:
+    flash('An error occured during insert, no shows were listed')
+    return render_template('forms/bulk_shows.html', form=form, errors=[]), 500
+  flash(f'{len(rows)} shows were successfully listed!')
+  return redirect(url_for('shows'))
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
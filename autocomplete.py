@@ -0,0 +1,151 @@
+from bisect import bisect_left, insort
+from heapq import merge
+from threading import Lock
+
+from sqlalchemy import select
+
+import events
+
+
+def normalize(text):
+    return ' '.join((text or '').lower().split())
+
+
+class PrefixIndex(object):
+    '''Sorted arrays of (key, id), one per entity, over venue and
+    artist names.
+
+    Every word of a name starts its own key ("the musical hop",
+    "musical hop", "hop"), so typing "mus" or "hop" finds
+    "The Musical Hop". A lookup is one bisect per entity plus a scan of
+    at most the matching keys, and never touches the database. Lookups
+    take the lock too, since writes insert into the arrays in place.
+
+    `fetch(entity, ids)` returns {id: name} from the database, for
+    changes that arrive without their values (see invalidation.py).'''
+
+    def __init__(self, sources=(), fetch=None):
+        self.sources = set(sources)
+        self.fetch = fetch
+        self.keys = {entity: [] for entity in self.sources}
+        self.names = {}
+        self.lock = Lock()
+
+    def _keys_for(self, id, name):
+        words = normalize(name).split(' ')
+        return [(' '.join(words[i:]), id) for i in range(len(words))]
+
+    def add(self, entity, id, name):
+        with self.lock:
+            self._remove(entity, id)
+            if not name:
+                return
+            self.names[(entity, id)] = name
+            keys = self.keys.setdefault(entity, [])
+            for key in self._keys_for(id, name):
+                insort(keys, key)
+
+    def remove(self, entity, id):
+        with self.lock:
+            self._remove(entity, id)
+
+    def _remove(self, entity, id):
+        name = self.names.pop((entity, id), None)
+        if name is None:
+            return
+        keys = self.keys[entity]
+        for key in self._keys_for(id, name):
+            i = bisect_left(keys, key)
+            if i < len(keys) and keys[i] == key:
+                del keys[i]
+
+    def clear(self):
+        with self.lock:
+            self.keys = {entity: [] for entity in self.sources}
+            self.names = {}
+
+    def load(self, entity, rows):
+        '''Bulk load (id, name) rows; much cheaper than add() per row.'''
+        with self.lock:
+            keys = self.keys.setdefault(entity, [])
+            for id, name in rows:
+                if name:
+                    self.names[(entity, id)] = name
+                    keys.extend(self._keys_for(id, name))
+            keys.sort()
+
+    def _matching(self, entity, prefix):
+        keys = self.keys.get(entity, ())
+        i = bisect_left(keys, (prefix,))
+        while i < len(keys) and keys[i][0].startswith(prefix):
+            key, id = keys[i]
+            yield key, entity, id
+            i += 1
+
+    def search(self, prefix, entity=None, limit=10):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        results = []
+        seen = set()
+        with self.lock:
+            entities = [entity] if entity else sorted(self.keys)
+            # without a type, interleave the entities in key order
+            for key, key_entity, id in merge(*[self._matching(e, prefix) for e in entities]):
+                if len(results) >= limit:
+                    break
+                if (key_entity, id) in seen:
+                    continue
+                name = self.names.get((key_entity, id))
+                if name is None:
+                    continue
+                seen.add((key_entity, id))
+                results.append({'type': key_entity, 'id': id, 'name': name})
+        return results
+
+    def on_commit(self, changes):
+        reload = {}
+        for change in changes:
+            if change.entity not in self.sources:
+                continue
+            if change.op == 'delete':
+                self.remove(change.entity, change.id)
+            elif 'name' not in change.values:
+                # trimmed payload: the name may or may not have changed
+                reload.setdefault(change.entity, set()).add(change.id)
+            else:
+                self.add(change.entity, change.id, change.values['name'])
+        for entity, ids in reload.items():
+            names = self.fetch(entity, ids) if self.fetch else {}
+            for id in ids:
+                self.add(entity, id, names.get(id))
+
+
+def init_app(app, db, sources):
+    '''`sources` maps an entity name to the model whose `name` column is
+    indexed, e.g. {'venues': Venue, 'artists': Artist}.'''
+    def fetch_names(entity, ids):
+        model = sources[entity]
+        # the primary, not a replica that may not have the change yet
+        with app.app_context(), db.engine.connect() as connection:
+            return dict(connection.execute(
+                select([model.id, model.name]).where(model.id.in_(ids))
+            ).fetchall())
+
+    index = PrefixIndex(sources, fetch_names)
+
+    @app.before_first_request
+    def load_prefix_index():
+        index.clear()
+        for entity, model in sources.items():
+            index.load(entity, db.session.query(model.id, model.name))
+
+    def reload_prefix_index():
+        with app.app_context():
+            load_prefix_index()
+            db.session.remove()
+
+    events.subscribe(index.on_commit)
+    events.on_reset(reload_prefix_index)
+    app.extensions['autocomplete'] = index
+    return index
@@ -0,0 +1,126 @@
+'''gzip / brotli compression of responses.
+
+Responses are compressed when the client accepts it, the mimetype is in
+COMPRESS_MIMETYPES and the body is at least COMPRESS_MIN_SIZE bytes.
+Streamed responses (see stream_template in app.py) can't be measured up
+front, so they are always compressed, chunk by chunk with a sync flush,
+so the client still gets the first rows right away. brotli is used when
+the `brotli` package is installed and the client prefers it.'''
+import time
+import zlib
+
+from flask import request
+
+import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class GzipEncoder(object):
+    name = 'gzip'
+
+    def __init__(self, level):
+        # wbits=31 writes the gzip header and trailer
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def chunk(self, data):
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.compressor.flush(zlib.Z_FINISH)
+
+    def whole(self, data):
+        return self.compressor.compress(data) + self.finish()
+
+
+class BrotliEncoder(object):
+    name = 'br'
+
+    def __init__(self, quality):
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def chunk(self, data):
+        return self.compressor.process(data) + self.compressor.flush()
+
+    def finish(self):
+        return self.compressor.finish()
+
+    def whole(self, data):
+        return self.compressor.process(data) + self.finish()
+
+
+def choose_encoder(config):
+    accepted = request.accept_encodings
+    gzip_q = accepted.quality('gzip')
+    if brotli is not None and accepted.quality('br') and accepted.quality('br') >= gzip_q:
+        return BrotliEncoder(config.get('COMPRESS_BROTLI_QUALITY', 4))
+    if gzip_q:
+        return GzipEncoder(config.get('COMPRESS_LEVEL', 6))
+    return None
+
+
+def stream(encoder, chunks, endpoint):
+    cpu = 0.0
+    try:
+        for data in chunks:
+            if isinstance(data, str):
+                data = data.encode('utf-8')
+            started = time.thread_time()
+            out = encoder.chunk(data)
+            cpu += time.thread_time() - started
+            if out:
+                yield out
+        started = time.thread_time()
+        out = encoder.finish()
+        cpu += time.thread_time() - started
+        yield out
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+        metrics.COMPRESSION_SECONDS.labels(endpoint, encoder.name).observe(cpu)
+
+
+def init_app(app):
+    config = app.config
+    mimetypes = set(config.get('COMPRESS_MIMETYPES', ['text/html']))
+    min_size = config.get('COMPRESS_MIN_SIZE', 1024)
+
+    @app.after_request
+    def compress(response):
+        if (
+            not config.get('COMPRESS', True)
+            or response.mimetype not in mimetypes
+            or response.direct_passthrough
+            or response.status_code < 200
+            or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers
+        ):
+            return response
+
+        # the body depends on Accept-Encoding whether or not we compress
+        response.vary.add('Accept-Encoding')
+        if request.method == 'HEAD':
+            return response
+
+        encoder = choose_encoder(config)
+        if encoder is None:
+            return response
+
+        endpoint = request.endpoint or 'unknown'
+        if response.is_streamed:
+            response.response = stream(encoder, response.response, endpoint)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < min_size:
+                return response
+            started = time.thread_time()
+            response.set_data(encoder.whole(data))
+            metrics.COMPRESSION_SECONDS.labels(endpoint, encoder.name).observe(
+                time.thread_time() - started
+            )
+        response.headers['Content-Encoding'] = encoder.name
+        return response
@@ -0,0 +1,128 @@
+import logging
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import func
+
+import events
+
+logger = logging.getLogger(__name__)
+
+
+class Dashboard(object):
+    '''Snapshot of recent and upcoming activity for the home page.
+
+    The snapshot is rebuilt by a background thread every `interval`
+    seconds, and shortly after any venue, artist or show write, so the
+    home page itself never runs an aggregate query. Writes arriving in a
+    burst are folded into one refresh at most every `min_interval`
+    seconds.'''
+
+    def __init__(self, build, interval=300, min_interval=2):
+        self.build = build
+        self.interval = interval
+        self.min_interval = min_interval
+        self.snapshot = None
+        self.dirty = threading.Event()
+        self.thread = None
+
+    def refresh(self):
+        try:
+            self.snapshot = self.build()
+        except Exception as e:
+            logger.error(f'Could not refresh the home page dashboard -- {e}')
+
+    def on_commit(self, changes):
+        if any(change.entity in ('venues', 'artists', 'shows') for change in changes):
+            self.dirty.set()
+
+    def run(self):
+        while True:
+            self.refresh()
+            self.dirty.wait(self.interval)
+            self.dirty.clear()
+            time.sleep(self.min_interval)
+
+    def start(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.thread = threading.Thread(target=self.run, name='dashboard', daemon=True)
+        self.thread.start()
+
+
+def build_snapshot(db, Venue, Artist, Show, size=6):
+    now = datetime.now()
+    recent_venues = (
+        db.session.query(Venue.id, Venue.name, Venue.city, Venue.state, Venue.image_link)
+        .order_by(Venue.id.desc()).limit(size).all()
+    )
+    recent_artists = (
+        db.session.query(Artist.id, Artist.name, Artist.city, Artist.state, Artist.image_link)
+        .order_by(Artist.id.desc()).limit(size).all()
+    )
+    upcoming_shows = (
+        db.session.query(
+            Show.start_time, Show.artist_id, Artist.name, Artist.image_link,
+            Show.venue_id, Venue.name,
+        )
+        .join(Artist, Show.artist_id == Artist.id)
+        .join(Venue, Show.venue_id == Venue.id)
+        .filter(Show.start_time >= now)
+        .order_by(Show.start_time).limit(size).all()
+    )
+    show_count = func.count(Show.id)
+    top_cities = (
+        db.session.query(Venue.city, Venue.state, show_count)
+        .join(Show, Show.venue_id == Venue.id)
+        .filter(Show.start_time >= now)
+        .group_by(Venue.city, Venue.state)
+        .order_by(show_count.desc()).limit(size).all()
+    )
+
+    return {
+        'built_at': now,
+        'recent_venues': [row._asdict() for row in recent_venues],
+        'recent_artists': [row._asdict() for row in recent_artists],
+        'upcoming_shows': [{
+            'start_time': str(start_time),
+            'artist_id': artist_id,
+            'artist_name': artist_name,
+            'artist_image_link': artist_image_link,
+            'venue_id': venue_id,
+            'venue_name': venue_name,
+        } for start_time, artist_id, artist_name, artist_image_link, venue_id, venue_name in upcoming_shows],
+        'top_cities': [
+            {'city': city, 'state': state, 'upcoming_shows': count}
+            for city, state, count in top_cities
+        ],
+    }
+
+
+def init_app(app, db, Venue, Artist, Show):
+    def build():
+        with app.app_context():
+            try:
+                return build_snapshot(
+                    db, Venue, Artist, Show, app.config.get('DASHBOARD_SIZE', 6)
+                )
+            finally:
+                db.session.remove()
+
+    dashboard = Dashboard(
+        build,
+        interval=app.config.get('DASHBOARD_REFRESH_SECONDS', 300),
+    )
+    events.subscribe(dashboard.on_commit)
+    events.on_reset(dashboard.dirty.set)
+
+    @app.before_first_request
+    def start_dashboard():
+        if not app.config.get('BACKGROUND_THREADS', True):
+            # e.g. a static export worker: build once, no refreshes
+            dashboard.refresh()
+            return
+        dashboard.start()
+
+    app.extensions['dashboard'] = dashboard
+    return dashboard
@@ -0,0 +1,191 @@
+'''Near-duplicate venues and artists ("Guns N Petals" / "Guns n' Petals").
+
+Rows are only compared within blocks: rows in the same city and state
+that share a normalized name token. Each row lands in a handful of
+blocks, so finding candidates stays close to linear in the number of
+rows; blocks over DEDUPE_MAX_BLOCK rows (very common words) are skipped.
+Candidates are scored by trigram similarity of the normalized names,
+the same measure as PostgreSQL's pg_trgm, computed here so the extension
+isn't required.
+
+`flask dedupe venues|artists` lists the candidate pairs, the create
+forms warn about likely duplicates, and `flask merge venues|artists KEEP
+DROP...` moves the shows of the dropped rows onto the kept one and
+deletes the dropped rows.'''
+import re
+import unicodedata
+from collections import defaultdict
+
+import click
+from sqlalchemy import func, or_
+
+import events
+
+# spellings of "and" ("n'" loses its quote below), and words too common
+# to say anything
+STOPWORDS = {'the', 'a', 'an', 'and', 'n', '&'}
+
+
+def tokens(name):
+    name = unicodedata.normalize('NFKD', name or '')
+    name = ''.join(c for c in name if not unicodedata.combining(c)).lower()
+    # "n'" is the same word as "n"; drop quotes inside words
+    name = re.sub(r"['’`]", '', name)
+    words = re.findall(r'[a-z0-9&]+', name)
+    return [w for w in words if w not in STOPWORDS] or words
+
+
+def normalize(name):
+    return ' '.join(tokens(name))
+
+
+def trigrams(text):
+    grams = set()
+    for word in text.split():
+        padded = '  ' + word + ' '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def similarity(a, b):
+    '''Trigram similarity of two names, 0.0 - 1.0, as pg_trgm computes it.'''
+    a, b = trigrams(normalize(a)), trigrams(normalize(b))
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def area_key(city, state):
+    return ((city or '').strip().lower(), (state or '').strip().lower())
+
+
+def blocking_keys(name, city, state):
+    area = area_key(city, state)
+    return {area + (token,) for token in tokens(name)}
+
+
+def candidate_pairs(rows, threshold=0.5, max_block=200):
+    '''Likely duplicates among `rows` of (id, name, city, state), as
+    (score, row, row) sorted best first.'''
+    blocks = defaultdict(list)
+    for row in rows:
+        for key in blocking_keys(row[1], row[2], row[3]):
+            blocks[key].append(row)
+
+    grams = {}
+    scored = {}
+    for block in blocks.values():
+        if len(block) < 2 or len(block) > max_block:
+            continue
+        for i, a in enumerate(block):
+            for b in block[i + 1:]:
+                pair = (a[0], b[0]) if a[0] < b[0] else (b[0], a[0])
+                if pair in scored:
+                    continue
+                ga = grams.setdefault(a[0], trigrams(normalize(a[1])))
+                gb = grams.setdefault(b[0], trigrams(normalize(b[1])))
+                score = len(ga & gb) / len(ga | gb) if ga and gb else 0.0
+                scored[pair] = (score, a, b) if a[0] < b[0] else (score, b, a)
+    return sorted(
+        (match for match in scored.values() if match[0] >= threshold),
+        key=lambda match: (-match[0], match[1][0], match[2][0]),
+    )
+
+
+def similar(db, Model, name, city, state, threshold=0.5, exclude=None, limit=5):
+    '''Existing rows that look like a duplicate of `name` in the same city
+    and state, as (score, id, name) sorted best first.'''
+    words = tokens(name)
+    if not words:
+        return []
+    query = (
+        db.session.query(Model.id, Model.name)
+        .filter(func.lower(Model.city) == (city or '').strip().lower())
+        .filter(func.lower(Model.state) == (state or '').strip().lower())
+        # same blocks as candidate_pairs; the names still need a
+        # token in common
+        .filter(or_(*[Model.name.ilike('%{}%'.format(word)) for word in words]))
+    )
+    if exclude is not None:
+        query = query.filter(Model.id != exclude)
+    matches = []
+    for id, other in query:
+        score = similarity(name, other)
+        if score >= threshold:
+            matches.append((score, id, other))
+    matches.sort(key=lambda match: (-match[0], match[1]))
+    return matches[:limit]
+
+
+def merge(db, Model, Show, keep_id, drop_ids):
+    '''Move the shows of `drop_ids` onto `keep_id` with one UPDATE, then
+    delete the dropped rows. Does not commit.'''
+    drop_ids = [id for id in drop_ids if id != keep_id]
+    if not drop_ids:
+        return 0
+    column = Show.venue_id if Model.__tablename__ == 'venues' else Show.artist_id
+    session = db.session()
+
+    # the UPDATE bypasses the unit of work, so tell the caches and the
+    # change feed about the moved shows ourselves
+    moved = (
+        session.query(Show.id, Show.venue_id, Show.artist_id, Show.start_time)
+        .filter(column.in_(drop_ids))
+        .all()
+    )
+    session.query(Show).filter(column.in_(drop_ids)).update(
+        {column: keep_id}, synchronize_session='fetch'
+    )
+    key = column.key
+    events.record(session, [
+        events.Change(
+            'shows', row.id, 'update',
+            dict(row._asdict(), **{key: keep_id}), {key: getattr(row, key)},
+        )
+        for row in moved
+    ])
+
+    for obj in session.query(Model).filter(Model.id.in_(drop_ids)):
+        session.delete(obj)
+    session.flush()
+    return len(moved)
+
+
+def init_app(app, db, Venue, Artist, Show):
+    models = {'venues': Venue, 'artists': Artist}
+
+    @app.cli.command('dedupe')
+    @click.argument('entity', type=click.Choice(sorted(models)))
+    @click.option('--threshold', default=None, type=float, help='Minimum similarity, 0-1.')
+    def dedupe(entity, threshold):
+        '''List likely duplicate venues or artists.'''
+        Model = models[entity]
+        threshold = threshold if threshold is not None else app.config.get('DEDUPE_THRESHOLD', 0.5)
+        rows = db.session.query(Model.id, Model.name, Model.city, Model.state).yield_per(
+            app.config.get('STREAM_YIELD_PER', 1000)
+        )
+        pairs = candidate_pairs(rows, threshold, app.config.get('DEDUPE_MAX_BLOCK', 200))
+        for score, a, b in pairs:
+            click.echo('{:.2f}  {} {!r}  ~  {} {!r}  ({}, {})'.format(
+                score, a[0], a[1], b[0], b[1], a[2], a[3]
+            ))
+        click.echo('{} candidate pairs'.format(len(pairs)))
+
+    @app.cli.command('merge')
+    @click.argument('entity', type=click.Choice(sorted(models)))
+    @click.argument('keep', type=int)
+    @click.argument('drop', type=int, nargs=-1, required=True)
+    def merge_command(entity, keep, drop):
+        '''Move the shows of DROP onto KEEP and delete DROP.'''
+        Model = models[entity]
+        if db.session.query(Model.id).filter(Model.id == keep).first() is None:
+            raise click.ClickException('No {} with id {}'.format(entity, keep))
+        try:
+            moved = merge(db, Model, Show, keep, drop)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        click.echo('{} shows moved, {} {} merged into {}'.format(
+            moved, len(set(drop) - {keep}), entity, keep
+        ))
@@ -0,0 +1,108 @@
+from collections import namedtuple
+
+from sqlalchemy import event, inspect
+
+# A committed write to one of the models. `values` is a snapshot of the
+# row's columns taken at flush time, so subscribers never have to touch
+# the (already expired) ORM instance after the commit. For updates `old`
+# holds the previous value of each changed column, when known.
+Change = namedtuple('Change', ['entity', 'id', 'op', 'values', 'old'], defaults=(None,))
+
+_subscribers = []
+_flush_handlers = []
+_reset_handlers = []
+
+
+def subscribe(fn):
+    '''Register `fn(changes)` to be called after every successful commit.'''
+    _subscribers.append(fn)
+    return fn
+
+
+def on_flush(fn):
+    '''Register `fn(session, changes)` to be called after every flush,
+    while the transaction is still open, for work that must commit or
+    roll back together with the changes (see outbox.py).'''
+    _flush_handlers.append(fn)
+    return fn
+
+
+def on_reset(fn):
+    '''Register `fn()` to drop everything it derived from the database,
+    for when changes may have been missed (see invalidation.py).'''
+    _reset_handlers.append(fn)
+    return fn
+
+
+def publish(changes):
+    for fn in _subscribers:
+        fn(changes)
+
+
+def reset():
+    for fn in _reset_handlers:
+        fn()
+
+
+def _snapshot(obj):
+    return {
+        attr.key: getattr(obj, attr.key)
+        for attr in inspect(obj).mapper.column_attrs
+    }
+
+
+def _previous(obj):
+    # after_flush still sees the attribute history of the flush
+    state = inspect(obj)
+    old = {}
+    for attr in state.mapper.column_attrs:
+        deleted = state.attrs[attr.key].history.deleted
+        if deleted:
+            old[attr.key] = deleted[0]
+    return old
+
+
+def _collect(session, flush_context):
+    flushed = []
+    for op, objs in (
+        ('insert', session.new),
+        ('update', session.dirty),
+        ('delete', session.deleted),
+    ):
+        for obj in objs:
+            if not hasattr(obj, '__tablename__'):
+                continue
+            if op == 'update' and not session.is_modified(obj):
+                continue
+            old = _previous(obj) if op == 'update' else None
+            flushed.append(Change(obj.__tablename__, obj.id, op, _snapshot(obj), old))
+    record(session, flushed)
+
+
+def record(session, changes):
+    '''Add `changes` to the open transaction of `session`, as if they had
+    been flushed. For bulk statements that bypass the unit of work (see
+    dedupe.merge).'''
+    if not changes:
+        return
+    session.info.setdefault('changes', []).extend(changes)
+    for fn in _flush_handlers:
+        fn(session, changes)
+
+
+def _publish(session):
+    changes = session.info.pop('changes', None)
+    if changes:
+        publish(changes)
+
+
+def _discard(session):
+    session.info.pop('changes', None)
+
+
+def track_changes(session):
+    '''Hook the flush/commit cycle of `session` (a scoped session or
+    session class) so committed writes reach the subscribers.'''
+    event.listen(session, 'after_flush', _collect)
+    event.listen(session, 'after_commit', _publish)
+    event.listen(session, 'after_rollback', _discard)
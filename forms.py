@@ -1,8 +1,9 @@
 from datetime import datetime
+from flask import current_app
 from flask_wtf import FlaskForm as Form
-from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField 
+from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField, HiddenField, IntegerField, TextAreaField
 from wtforms_alchemy import PhoneNumberField
-from wtforms.validators import DataRequired, AnyOf, URL
+from wtforms.validators import DataRequired, InputRequired, AnyOf, URL, ValidationError
 
 state_choices=[
             ('AL', 'AL'),
@@ -77,19 +78,72 @@ genre_choices=[('Alternative', 'Alternative'),
             ('Soul', 'Soul'),
             ('Other', 'Other'),]
 
-class ShowForm(Form):
-    artist_id = StringField(
-        'artist_id'
-    )
-    venue_id = StringField(
-        'venue_id'
+class Exists(object):
+    '''Checks that an artist or venue id exists, against the cached
+    id -> name lookup (see lookups.py).'''
+
+    def __init__(self, entity, message=None):
+        self.entity = entity
+        self.message = message
+
+    def __call__(self, form, field):
+        if field.data is None:
+            return
+        lookup = current_app.extensions['name_lookup']
+        if lookup.get(self.entity, field.data) is None:
+            raise ValidationError(
+                self.message or 'There is no {} with ID {}'.format(self.entity[:-1], field.data)
+            )
+
+def id_field(entity):
+    # a number input with suggestions by name from /autocomplete
+    return IntegerField(
+        entity[:-1] + '_id',
+        validators=[DataRequired(), Exists(entity)],
+        render_kw={
+            'list': entity + '-suggestions',
+            'autocomplete': 'off',
+            'data-autocomplete': entity,
+            'data-autocomplete-value': 'id',
+        }
     )
-    start_time = DateTimeField(
+
+class StartTimeField(DateTimeField):
+    '''A DateTimeField that also takes times without seconds, as the
+    forms ask for ("YYYY-MM-DD HH:MM").'''
+
+    formats = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M')
+
+    def process_formdata(self, valuelist):
+        if not valuelist:
+            return
+        value = ' '.join(valuelist).strip()
+        for format in self.formats:
+            try:
+                self.data = datetime.strptime(value, format)
+                return
+            except ValueError:
+                pass
+        self.data = None
+        raise ValueError(self.gettext('Not a valid date/time, use YYYY-MM-DD HH:MM'))
+
+class ShowForm(Form):
+    artist_id = id_field('artists')
+    venue_id = id_field('venues')
+    # InputRequired, not DataRequired: the latter would replace the
+    # parse error with "This field is required."
+    start_time = StartTimeField(
         'start_time',
-        validators=[DataRequired()],
+        validators=[InputRequired()],
         default= datetime.today()
     )
 
+class BulkShowForm(Form):
+    # one show per line: artist id, venue id, start time
+    shows = TextAreaField(
+        'shows', validators=[DataRequired()]
+    )
+
 class VenueForm(Form):
     name = StringField(
         'name', validators=[DataRequired()]
@@ -122,6 +176,7 @@ class VenueForm(Form):
     )
     seeking_talent = BooleanField('Seeking Talent?')
     seeking_description = StringField('Talent Description?')
+    version_id = HiddenField('version_id')
 
 class ArtistForm(Form):
     name = StringField(
@@ -149,4 +204,5 @@ class ArtistForm(Form):
     )
     seeking_venue = BooleanField('Seeking Venue?')
     seeking_description = StringField('Venue Description?')
+    version_id = HiddenField('version_id')
 
@@ -0,0 +1,104 @@
+from collections import OrderedDict
+from threading import Lock
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+import events
+
+
+class FragmentCache(object):
+    '''Bounded LRU of rendered template fragments plus version counters
+    for (entity, id). Fragments embed the versions they depend on in their
+    key, so a write only has to bump a counter; the old fragment is never
+    hit again and ages out of the LRU.
+
+    The counters are a fixed array of `slots`, indexed by hash, so they
+    don't grow with the number of rows ever written. Rows sharing a slot
+    just invalidate each other's fragments now and then. A counter only
+    ever goes up, so a stale fragment is never hit again.'''
+
+    def __init__(self, maxsize=5000, slots=65536):
+        self.maxsize = maxsize
+        self.fragments = OrderedDict()
+        self.versions = [0] * slots
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            html = self.fragments.get(key)
+            if html is not None:
+                self.fragments.move_to_end(key)
+            return html
+
+    def set(self, key, html):
+        with self.lock:
+            self.fragments[key] = html
+            self.fragments.move_to_end(key)
+            while len(self.fragments) > self.maxsize:
+                self.fragments.popitem(last=False)
+
+    def _slot(self, entity, id):
+        return hash((entity, id)) % len(self.versions)
+
+    def version(self, entity, id):
+        return self.versions[self._slot(entity, id)]
+
+    def bump(self, entity, id):
+        with self.lock:
+            self.versions[self._slot(entity, id)] += 1
+
+    def clear(self):
+        # the counters stay: a fragment rendered during the clear still
+        # carries versions that are never handed out again
+        with self.lock:
+            self.fragments.clear()
+
+    def on_commit(self, changes):
+        for change in changes:
+            self.bump(change.entity, change.id)
+
+
+class FragmentCacheExtension(Extension):
+    '''Adds `{% cache 'name', key, ... %}...{% endcache %}` to templates.
+
+    The body is rendered once per distinct key and served from the cache
+    afterwards. Use `cache_version(entity, id)` in the key for fragments
+    that show database rows, e.g.
+
+      {% cache 'show-tile', show.id, cache_version('shows', show.id) %}
+    '''
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        parts = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            parts.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method('_render', [nodes.List(parts)]), [], [], body
+        ).set_lineno(lineno)
+
+    def _render(self, parts, caller):
+        store = self.environment.fragment_cache
+        key = tuple(parts)
+        html = store.get(key)
+        if html is None:
+            html = caller()
+            store.set(key, html)
+        return html
+
+
+def init_app(app):
+    store = FragmentCache(
+        app.config.get('FRAGMENT_CACHE_SIZE', 5000),
+        app.config.get('FRAGMENT_VERSION_SLOTS', 65536),
+    )
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.jinja_env.fragment_cache = store
+    app.jinja_env.globals['cache_version'] = store.version
+    events.subscribe(store.on_commit)
+    events.on_reset(store.clear)
+    app.extensions['fragment_cache'] = store
+    return store
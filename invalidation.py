@@ -0,0 +1,183 @@
+import json
+import logging
+import os
+import select
+import threading
+import time
+import uuid
+
+import events
+
+logger = logging.getLogger(__name__)
+
+# pg_notify payloads are capped at 8000 bytes
+MAX_PAYLOAD = 7500
+
+
+class InvalidationBus(object):
+    '''Shares committed changes between workers over PostgreSQL
+    LISTEN/NOTIFY.
+
+    Local writes queue their pg_notify on the flushing session's own
+    connection, so PostgreSQL delivers it exactly when that transaction
+    commits, and drops it if it rolls back. A listener
+    thread in every worker replays the changes from other workers through
+    events.publish(), so the in-process caches apply them exactly as they
+    apply local writes. Notifications sent while the listener was
+    disconnected are lost, so every reconnect ends with events.reset(),
+    and so does the first connect if the caches may have loaded before
+    it (see start()).'''
+
+    def __init__(self, engine, channel='fyyur_changes', poll_interval=5.0):
+        self.engine = engine
+        self.channel = channel
+        self.poll_interval = poll_interval
+        self.origin = '{}-{}'.format(os.getpid(), uuid.uuid4().hex[:8])
+        self.applying = threading.local()
+        self.thread = None
+        self.running = False
+        self.listening = threading.Event()
+        self.late = False
+        self.lock = threading.Lock()
+
+    # Publishing
+    # ------------------------------------------------------------------
+
+    def encode(self, changes):
+        '''Split `changes` into JSON payloads that fit in one NOTIFY.'''
+        payloads = []
+        batch = []
+        size = 0
+        for change in changes:
+            item = json.dumps(
+                [change.entity, change.id, change.op, change.values, change.old],
+                default=str,
+            )
+            if len(item) > MAX_PAYLOAD:
+                # too large to ship the row itself; the receivers only
+                # need to know which row went stale
+                item = json.dumps([change.entity, change.id, change.op, {}])
+            if batch and size + len(item) > MAX_PAYLOAD:
+                payloads.append(self._payload(batch))
+                batch, size = [], 0
+            batch.append(item)
+            size += len(item) + 1
+        if batch:
+            payloads.append(self._payload(batch))
+        return payloads
+
+    def _payload(self, items):
+        return '{{"origin": {}, "changes": [{}]}}'.format(
+            json.dumps(self.origin), ','.join(items)
+        )
+
+    def notify(self, session, changes):
+        '''events.on_flush handler: queue the NOTIFYs in the flushing
+        transaction, which then commits or rolls back together with them.'''
+        connection = session.connection()
+        if connection.dialect.name != 'postgresql':
+            return
+        for payload in self.encode(changes):
+            connection.execute('SELECT pg_notify(%s, %s)', (self.channel, payload))
+
+    # Listening
+    # ------------------------------------------------------------------
+
+    def decode(self, payload):
+        message = json.loads(payload)
+        if message.get('origin') == self.origin:
+            return []
+        # [entity, id, op, values, old]; trimmed ones have no old
+        return [events.Change(*item) for item in message['changes']]
+
+    def apply(self, changes):
+        if not changes:
+            return
+        self.applying.remote = True
+        try:
+            events.publish(changes)
+        finally:
+            self.applying.remote = False
+
+    def _connect(self):
+        fairy = self.engine.raw_connection()
+        fairy.detach()
+        conn = fairy.connection
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute('LISTEN {}'.format(self.channel))
+        return conn
+
+    def listen(self):
+        backoff = 1
+        connected_before = False
+        while self.running:
+            conn = None
+            try:
+                conn = self._connect()
+                with self.lock:
+                    missed = connected_before or self.late
+                    self.listening.set()
+                if missed:
+                    # anything sent while we were not listening is gone
+                    events.reset()
+                connected_before = True
+                backoff = 1
+                while self.running:
+                    ready, _, _ = select.select([conn], [], [], self.poll_interval)
+                    if not ready:
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        self.apply(self.decode(notify.payload))
+            except Exception as e:
+                logger.error(f'Invalidation listener lost connection -- {e}')
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+    def start(self, wait=5.0):
+        '''Start listening, waiting up to `wait` seconds for the LISTEN,
+        so that caches loaded afterwards can't miss a notification.'''
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.running = True
+        self.thread = threading.Thread(
+            target=self.listen, name='invalidation-listener', daemon=True
+        )
+        self.thread.start()
+        if not self.listening.wait(wait):
+            with self.lock:
+                # still not listening: reset once it is
+                self.late = not self.listening.is_set()
+            logger.warning('Invalidation listener not connected yet; caches reset once it is')
+
+    def stop(self):
+        self.running = False
+
+
+def init_app(app, db):
+    bus = InvalidationBus(
+        db.engine,
+        channel=app.config.get('INVALIDATION_CHANNEL', 'fyyur_changes'),
+    )
+    events.on_flush(bus.notify)
+
+    # started per worker on its first request, so preforking servers get
+    # one listener in every child rather than one in the parent; and
+    # before the caches load on that same first request (see start())
+    def start_invalidation_listener():
+        if not app.config.get('BACKGROUND_THREADS', True):
+            return
+        bus.start(app.config.get('INVALIDATION_CONNECT_WAIT', 5))
+
+    app.before_first_request_funcs.insert(0, start_invalidation_listener)
+
+    app.extensions['invalidation'] = bus
+    return bus
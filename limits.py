@@ -0,0 +1,136 @@
+import math
+import time
+from collections import Counter, OrderedDict
+from functools import wraps
+from threading import BoundedSemaphore, Lock
+
+from flask import Response, current_app, request
+
+import metrics
+
+
+class TokenBucket(object):
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def take(self, now):
+        '''Take one token. Returns 0 on success, otherwise the number of
+        seconds until the next token is available.'''
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class Limiter(object):
+    '''Per-client token buckets and per-group concurrency caps, both
+    rejecting immediately instead of queueing.
+
+    `rate_limits` maps a group name to (requests per second, burst);
+    `concurrency_limits` maps a group name to the number of requests of
+    that group allowed in flight at once in this worker. `client_key()`
+    names the client of the current request, by default its address
+    (see TRUSTED_PROXIES in config.py).'''
+
+    def __init__(self, rate_limits=None, concurrency_limits=None, max_clients=10000,
+                 client_key=None):
+        self.rate_limits = rate_limits or {}
+        self.client_key = client_key or (lambda: request.remote_addr)
+        self.slots = {
+            group: BoundedSemaphore(n)
+            for group, n in (concurrency_limits or {}).items()
+        }
+        self.max_clients = max_clients
+        # least recently used first
+        self.buckets = OrderedDict()
+        self.lock = Lock()
+        self.rejected = Counter()
+
+    def _bucket(self, group, client):
+        key = (group, client)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.max_clients:
+                self._prune()
+            rate, burst = self.rate_limits[group]
+            bucket = self.buckets[key] = TokenBucket(rate, burst)
+        else:
+            self.buckets.move_to_end(key)
+        return bucket
+
+    def _prune(self):
+        # drop the idle buckets that have refilled completely; they behave
+        # exactly like a new bucket would
+        now = time.monotonic()
+        for key, bucket in list(self.buckets.items()):
+            if bucket.tokens + (now - bucket.updated) * bucket.rate < bucket.burst:
+                break
+            del self.buckets[key]
+        # all still in use: forget the least recently used one, which at
+        # worst gives that client a fresh burst
+        while len(self.buckets) >= self.max_clients:
+            self.buckets.popitem(last=False)
+
+    def retry_after(self, group, client):
+        if group not in self.rate_limits:
+            return 0
+        with self.lock:
+            return self._bucket(group, client).take(time.monotonic())
+
+    def reject(self, group, status):
+        self.rejected[(group, request.endpoint, status)] += 1
+        metrics.REJECTED.labels(group, request.endpoint, status).inc()
+
+    def limit(self, group):
+        '''Decorator applying the limits of `group` to a view.'''
+        def decorator(f):
+            @wraps(f)
+            def decorated(*args, **kwargs):
+                if not current_app.config.get('RATE_LIMITING', True):
+                    return f(*args, **kwargs)
+
+                wait = self.retry_after(group, self.client_key())
+                if wait:
+                    self.reject(group, 429)
+                    return Response(
+                        'Too many requests, please slow down.',
+                        status=429,
+                        headers={'Retry-After': str(int(math.ceil(wait)))},
+                    )
+
+                slots = self.slots.get(group)
+                if slots is None:
+                    return f(*args, **kwargs)
+                if not slots.acquire(blocking=False):
+                    self.reject(group, 503)
+                    return Response(
+                        'The server is busy, please try again shortly.',
+                        status=503,
+                        headers={'Retry-After': '1'},
+                    )
+                try:
+                    return f(*args, **kwargs)
+                finally:
+                    slots.release()
+            return decorated
+        return decorator
+
+    def stats(self):
+        return [
+            {'group': group, 'endpoint': endpoint, 'status': status, 'count': count}
+            for (group, endpoint, status), count in sorted(self.rejected.items())
+        ]
+
+
+def init_app(app):
+    limiter = Limiter(
+        app.config.get('RATE_LIMITS'),
+        app.config.get('CONCURRENCY_LIMITS'),
+    )
+    app.extensions['limiter'] = limiter
+    return limiter
@@ -0,0 +1,93 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+import events
+
+
+class NameLookup(object):
+    '''Cached id -> name of venues and artists, for validating the ids
+    submitted with shows (see ShowForm).
+
+    Ids are loaded on demand: `prefetch` resolves every id of a batch
+    that isn't cached yet with one IN (...) query per entity, so
+    validating the rows afterwards never goes back to the database. Ids
+    that don't exist are remembered for `miss_ttl` seconds. Committed
+    writes keep the cached names current.'''
+
+    def __init__(self, load, maxsize=10000, miss_ttl=5):
+        self.load = load
+        self.maxsize = maxsize
+        self.miss_ttl = miss_ttl
+        self.names = {'venues': OrderedDict(), 'artists': OrderedDict()}
+        self.missing = {'venues': {}, 'artists': {}}
+        self.lock = Lock()
+
+    def _store(self, entity, id, name):
+        names = self.names[entity]
+        names[id] = name
+        names.move_to_end(id)
+        self.missing[entity].pop(id, None)
+        while len(names) > self.maxsize:
+            names.popitem(last=False)
+
+    def prefetch(self, entity, ids):
+        now = time.monotonic()
+        with self.lock:
+            names = self.names[entity]
+            missing = self.missing[entity]
+            unknown = {
+                id for id in ids
+                if id not in names and missing.get(id, 0) < now
+            }
+        if not unknown:
+            return
+        found = self.load(entity, sorted(unknown))
+        with self.lock:
+            for id, name in found.items():
+                self._store(entity, id, name)
+            for id in unknown - set(found):
+                self.missing[entity][id] = now + self.miss_ttl
+
+    def get(self, entity, id):
+        '''Name of venue / artist `id`, or None if there is no such row.'''
+        self.prefetch(entity, [id])
+        with self.lock:
+            return self.names[entity].get(id)
+
+    def on_commit(self, changes):
+        with self.lock:
+            for change in changes:
+                if change.entity not in self.names:
+                    continue
+                name = change.values.get('name')
+                if change.op == 'delete' or name is None:
+                    # gone, or a trimmed notification: look it up again
+                    self.names[change.entity].pop(change.id, None)
+                    self.missing[change.entity].pop(change.id, None)
+                else:
+                    self._store(change.entity, change.id, name)
+
+    def clear(self):
+        with self.lock:
+            for entity in self.names:
+                self.names[entity].clear()
+                self.missing[entity].clear()
+
+
+def init_app(app, db, models):
+    def load(entity, ids):
+        Model = models[entity]
+        return dict(
+            db.session.query(Model.id, Model.name).filter(Model.id.in_(ids))
+        )
+
+    lookup = NameLookup(
+        load,
+        maxsize=app.config.get('NAME_LOOKUP_SIZE', 10000),
+        miss_ttl=app.config.get('NAME_LOOKUP_MISS_TTL', 5),
+    )
+    events.subscribe(lookup.on_commit)
+    events.on_reset(lookup.clear)
+    app.extensions['name_lookup'] = lookup
+    return lookup
@@ -0,0 +1,254 @@
+'''Matchmaking between venues seeking talent and artists seeking venues.
+
+Only seeking venues and artists are indexed, each under its (city, state)
+area and an inverted index of area + genre. Ranking one venue walks the
+artists listed under its own area and genres, so the cost depends on the
+number of real candidates rather than venues x artists. Candidates are
+ordered by genre overlap, then by recent show activity (shows in the
+last MATCH_ACTIVITY_DAYS days or upcoming).
+
+Venue and artist writes update the index in place; show writes within
+the activity window adjust the activity counts, a moved show (a merge)
+by its previous values. Changes that arrive without their row trigger
+a rebuild instead. A full rebuild every MATCH_REBUILD_SECONDS also lets
+old shows age out of the activity window.
+
+A rebuild's queries may or may not see a commit that lands while they
+run. Venue and artist writes from that time are replayed onto the new
+index, since putting a row twice is harmless; counting a show twice is
+not, so a show write during a rebuild just asks for another one.'''
+import logging
+import threading
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+import events
+
+logger = logging.getLogger(__name__)
+
+SEEKING = {'venues': 'seeking_talent', 'artists': 'seeking_venue'}
+OTHER = {'venues': 'artists', 'artists': 'venues'}
+
+
+def area_of(values):
+    return (
+        (values.get('city') or '').strip().lower(),
+        (values.get('state') or '').strip().upper(),
+    )
+
+
+def start_time_of(values):
+    start_time = values.get('start_time')
+    if isinstance(start_time, str):
+        # from another worker, see invalidation.py
+        start_time = datetime.fromisoformat(start_time)
+    return start_time
+
+
+class MatchIndex(object):
+    def __init__(self, activity_days=90):
+        self.activity_days = activity_days
+        self.lock = threading.Lock()
+        # venue and artist changes since begin_load(), None otherwise
+        self.pending = None
+        self._reset()
+
+    def _reset(self):
+        self.entries = {'venues': {}, 'artists': {}}
+        self.by_genre = {'venues': defaultdict(set), 'artists': defaultdict(set)}
+        self.activity = {'venues': Counter(), 'artists': Counter()}
+
+    def _remove(self, kind, id):
+        entry = self.entries[kind].pop(id, None)
+        if entry is None:
+            return
+        for genre in entry['genres']:
+            key = (entry['area'], genre)
+            self.by_genre[kind][key].discard(id)
+            if not self.by_genre[kind][key]:
+                del self.by_genre[kind][key]
+
+    def _put(self, kind, id, values):
+        self._remove(kind, id)
+        if not values.get(SEEKING[kind]):
+            return
+        entry = {
+            'id': id,
+            'name': values.get('name'),
+            'city': values.get('city'),
+            'state': values.get('state'),
+            'area': area_of(values),
+            'genres': frozenset(g.lower() for g in values.get('genres') or ()),
+            'seeking_description': values.get('seeking_description'),
+        }
+        self.entries[kind][id] = entry
+        for genre in entry['genres']:
+            self.by_genre[kind][(entry['area'], genre)].add(id)
+
+    def begin_load(self):
+        '''Call before reading the rows for load().'''
+        with self.lock:
+            self.pending = []
+
+    def end_load(self):
+        with self.lock:
+            self.pending = None
+
+    def load(self, venues, artists, activity):
+        '''Replace the whole index. `venues` and `artists` are dicts of
+        column values; `activity` maps (kind, id) to a show count.'''
+        with self.lock:
+            self._reset()
+            for values in venues:
+                self._put('venues', values['id'], values)
+            for values in artists:
+                self._put('artists', values['id'], values)
+            for (kind, id), count in activity.items():
+                self.activity[kind][id] = count
+            for change in self.pending or ():
+                self._apply(change)
+            self.pending = None
+
+    def matches(self, kind, id, limit=5):
+        '''Best candidates of the other kind for one seeking venue or
+        artist, as (entry, shared genres, activity) tuples.'''
+        other = OTHER[kind]
+        with self.lock:
+            me = self.entries[kind].get(id)
+            if me is None:
+                return []
+            shared = defaultdict(set)
+            for genre in me['genres']:
+                for candidate in self.by_genre[other].get((me['area'], genre), ()):
+                    shared[candidate].add(genre)
+            ranked = sorted(
+                shared,
+                key=lambda c: (-len(shared[c]), -self.activity[other][c], c),
+            )[:limit]
+            return [
+                (self.entries[other][c], sorted(shared[c]), self.activity[other][c])
+                for c in ranked
+            ]
+
+    def seeking(self, kind, city=None, state=None):
+        city, state = area_of({'city': city, 'state': state})
+        with self.lock:
+            entries = list(self.entries[kind].values())
+        if city:
+            entries = [e for e in entries if e['area'][0] == city]
+        if state:
+            entries = [e for e in entries if e['area'][1] == state]
+        return sorted(entries, key=lambda e: (e['area'], e['name'] or ''))
+
+    def _apply(self, change):
+        if change.op == 'delete':
+            self._remove(change.entity, change.id)
+        else:
+            self._put(change.entity, change.id, change.values)
+
+    def _count(self, show, step, since):
+        start_time = start_time_of(show)
+        if start_time is None or start_time < since:
+            return
+        for kind, key in (('venues', 'venue_id'), ('artists', 'artist_id')):
+            if show.get(key) is not None:
+                self.activity[kind][show[key]] += step
+
+    def on_commit(self, changes):
+        '''Apply committed writes. Returns True when a change can't be
+        applied in place (a show update without its previous values, or
+        a change trimmed by invalidation.py) and the index needs a
+        rebuild.'''
+        incomplete = False
+        # same window as load_index()
+        since = datetime.now() - timedelta(days=self.activity_days)
+        with self.lock:
+            for change in changes:
+                if change.entity in SEEKING:
+                    if change.op != 'delete' and SEEKING[change.entity] not in change.values:
+                        incomplete = True
+                        continue
+                    self._apply(change)
+                    if self.pending is not None:
+                        self.pending.append(change)
+                elif change.entity == 'shows':
+                    if self.pending is not None:
+                        # the rebuild may count it or not; count it afresh
+                        incomplete = True
+                    if not change.values or (change.op == 'update' and change.old is None):
+                        incomplete = True
+                    elif change.op == 'update':
+                        self._count(dict(change.values, **change.old), -1, since)
+                        self._count(change.values, 1, since)
+                    else:
+                        self._count(change.values, 1 if change.op == 'insert' else -1, since)
+        return incomplete
+
+
+def load_index(index, db, Venue, Artist, Show, activity_days):
+    index.begin_load()
+    columns = ['id', 'name', 'city', 'state', 'genres', 'seeking_description']
+    # filtering on the bare flags matches the partial index predicates
+    venues = [
+        dict(zip(columns + ['seeking_talent'], row)) for row in
+        db.session.query(*[getattr(Venue, c) for c in columns] + [Venue.seeking_talent])
+        .filter(Venue.seeking_talent)
+    ]
+    artists = [
+        dict(zip(columns + ['seeking_venue'], row)) for row in
+        db.session.query(*[getattr(Artist, c) for c in columns] + [Artist.seeking_venue])
+        .filter(Artist.seeking_venue)
+    ]
+    since = datetime.now() - timedelta(days=activity_days)
+    activity = {}
+    for kind, column in (('venues', Show.venue_id), ('artists', Show.artist_id)):
+        for id, count in (
+            db.session.query(column, db.func.count(Show.id))
+            .filter(Show.start_time >= since)
+            .group_by(column)
+        ):
+            activity[(kind, id)] = count
+    index.load(venues, artists, activity)
+
+
+def init_app(app, db, Venue, Artist, Show):
+    activity_days = app.config.get('MATCH_ACTIVITY_DAYS', 90)
+    index = MatchIndex(activity_days)
+    interval = app.config.get('MATCH_REBUILD_SECONDS', 3600)
+    stale = threading.Event()
+
+    # the rebuild thread and events.reset() may both rebuild
+    loading = threading.Lock()
+
+    def rebuild():
+        with loading, app.app_context():
+            try:
+                load_index(index, db, Venue, Artist, Show, activity_days)
+            except Exception as e:
+                index.end_load()
+                logger.error(f'Could not rebuild the match index -- {e}')
+            finally:
+                db.session.remove()
+
+    def run():
+        while True:
+            rebuild()
+            # on schedule, or as soon as a commit couldn't be applied;
+            # commits arriving meanwhile share the next rebuild
+            stale.wait(interval)
+            stale.clear()
+
+    @app.before_first_request
+    def start_match_index():
+        if not app.config.get('BACKGROUND_THREADS', True):
+            return
+        threading.Thread(target=run, name='match-index', daemon=True).start()
+
+    def on_commit(changes):
+        if index.on_commit(changes):
+            stale.set()
+
+    events.subscribe(on_commit)
+    events.on_reset(rebuild)
+    app.extensions['matching'] = index
+    return index
@@ -0,0 +1,209 @@
+'''Prometheus metrics, served at /metrics.
+
+With several worker processes, point the `prometheus_multiproc_dir`
+environment variable at an empty directory before starting the server.
+Every worker then writes its samples to memory-mapped files there and
+/metrics adds them up, whichever worker answers the scrape. Under
+gunicorn also call `multiprocess.mark_process_dead(worker.pid)` from the
+`child_exit` hook.'''
+import os
+import time
+
+from flask import Response, g, has_request_context, request
+from jinja2 import Template
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+FAST_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5)
+
+REQUEST_LATENCY = Histogram(
+    'fyyur_request_duration_seconds', 'Time spent handling a request',
+    ['endpoint', 'method'],
+)
+STREAM_DURATION = Histogram(
+    'fyyur_event_stream_duration_seconds', 'How long server-sent event streams stay open',
+    ['endpoint'], buckets=(1, 10, 60, 300, 900, 1800, 3600, 4 * 3600),
+)
+REQUESTS = Counter(
+    'fyyur_requests_total', 'Requests handled',
+    ['endpoint', 'method', 'status'],
+)
+IN_FLIGHT = Gauge(
+    'fyyur_requests_in_flight', 'Requests currently being handled',
+    multiprocess_mode='livesum',
+)
+SQL_LATENCY = Histogram(
+    'fyyur_sql_query_duration_seconds', 'Time spent executing SQL statements',
+    ['endpoint'], buckets=FAST_BUCKETS,
+)
+POOL_CHECKOUTS = Counter(
+    'fyyur_pool_checkouts_total', 'Connections checked out of the pool',
+    ['database'],
+)
+POOL_CHECKED_OUT = Gauge(
+    'fyyur_pool_checked_out', 'Connections currently checked out',
+    ['database'], multiprocess_mode='livesum',
+)
+POOL_OVERFLOW = Gauge(
+    'fyyur_pool_overflow', 'Connections open beyond the pool size',
+    ['database'], multiprocess_mode='livesum',
+)
+TEMPLATE_LATENCY = Histogram(
+    'fyyur_template_render_seconds', 'Time spent rendering templates',
+    ['template'], buckets=FAST_BUCKETS,
+)
+COMPRESSION_SECONDS = Histogram(
+    'fyyur_compression_cpu_seconds', 'CPU time spent compressing responses',
+    ['endpoint', 'encoding'], buckets=FAST_BUCKETS,
+)
+REJECTED = Counter(
+    'fyyur_rejected_requests_total', 'Requests turned away by admission control',
+    ['group', 'endpoint', 'status'],
+)
+
+
+def current_endpoint():
+    if has_request_context():
+        return request.endpoint or 'unknown'
+    return 'none'
+
+
+# Requests
+# ----------------------------------------------------------------------
+
+def before_request():
+    g.request_started = time.perf_counter()
+    IN_FLIGHT.inc()
+
+
+def after_request(response):
+    started = g.get('request_started')
+    if started is None:
+        return response
+    endpoint = current_endpoint()
+    method = request.method
+    status = response.status_code
+
+    def record():
+        if response.mimetype == 'text/event-stream':
+            # open for as long as the client listens, which would swamp
+            # the request latencies (see show_stream.py)
+            STREAM_DURATION.labels(endpoint).observe(time.perf_counter() - started)
+        else:
+            REQUEST_LATENCY.labels(endpoint, method).observe(time.perf_counter() - started)
+        REQUESTS.labels(endpoint, method, status).inc()
+
+    if response.is_streamed:
+        # the body hasn't been generated yet (see stream_template in
+        # app.py); count the request once the last chunk is sent
+        response.call_on_close(record)
+    else:
+        record()
+    return response
+
+
+def teardown_request(exc):
+    # runs even when the view raised, unlike after_request
+    if g.pop('request_started', None) is not None:
+        IN_FLIGHT.dec()
+
+
+# SQL and the connection pool
+# ----------------------------------------------------------------------
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_started'].pop()
+    SQL_LATENCY.labels(current_endpoint()).observe(time.perf_counter() - started)
+
+
+@event.listens_for(Engine, 'handle_error')
+def _query_failed(exception_context):
+    conn = exception_context.connection
+    if conn is not None and conn.info.get('query_started'):
+        conn.info['query_started'].pop()
+
+
+def watch_pool(pool, database):
+    def usage(*args):
+        if hasattr(pool, 'checkedout'):
+            POOL_CHECKED_OUT.labels(database).set(pool.checkedout())
+        if hasattr(pool, 'overflow'):
+            POOL_OVERFLOW.labels(database).set(max(pool.overflow(), 0))
+
+    def checkout(*args):
+        POOL_CHECKOUTS.labels(database).inc()
+        usage()
+
+    event.listen(pool, 'checkout', checkout)
+    event.listen(pool, 'checkin', usage)
+
+
+# Templates
+# ----------------------------------------------------------------------
+
+class TimedTemplate(Template):
+    def render(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super(TimedTemplate, self).render(*args, **kwargs)
+        finally:
+            TEMPLATE_LATENCY.labels(self.name or 'string').observe(
+                time.perf_counter() - started
+            )
+
+    def generate(self, *args, **kwargs):
+        # what stream() iterates; only the time spent producing chunks
+        # counts, not the time the server spends sending them
+        chunks = super(TimedTemplate, self).generate(*args, **kwargs)
+        elapsed = 0
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed += time.perf_counter() - started
+                yield chunk
+        finally:
+            TEMPLATE_LATENCY.labels(self.name or 'string').observe(elapsed)
+
+
+# Exposition
+# ----------------------------------------------------------------------
+
+def metrics_view():
+    if 'prometheus_multiproc_dir' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+def init_app(app, engines):
+    app.before_request(before_request)
+    app.after_request(after_request)
+    app.teardown_request(teardown_request)
+    for engine in engines:
+        # repr() of the URL masks the password
+        watch_pool(engine.pool, repr(engine.url))
+    app.jinja_env.template_class = TimedTemplate
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
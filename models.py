@@ -1,11 +1,28 @@
-from app import db
+from routing import RoutingSQLAlchemy
+
+# created here rather than in app.py, so importing the models doesn't
+# import the app; app.py binds it with db.init_app()
+db = RoutingSQLAlchemy()
+
+# a text[] on PostgreSQL, a JSON list on SQLite (see snapshot.py)
+Genres = db.ARRAY(db.String()).with_variant(db.JSON(), 'sqlite')
 
 class Venue(db.Model):
     __tablename__ = 'venues'
+    __table_args__ = (
+        # /venues streams venues in this order
+        db.Index('ix_venues_city_state_name', 'city', 'state', 'name'),
+        # partial, only the few venues looking for artists (see matching.py)
+        db.Index(
+            'ix_venues_seeking_talent', 'city', 'state',
+            postgresql_where=db.text('seeking_talent'),
+            sqlite_where=db.text('seeking_talent'),
+        ),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
-    genres = db.Column(db.ARRAY(db.String()))
+    genres = db.Column(Genres)
     address = db.Column(db.String(120))
     city = db.Column(db.String(120))
     state = db.Column(db.String(120))
@@ -15,37 +32,109 @@ class Venue(db.Model):
     website = db.Column(db.String(120))
     seeking_talent = db.Column(db.Boolean)
     seeking_description = db.Column(db.String(500))
+    version_id = db.Column(db.Integer, nullable=False, server_default='1')
     shows = db.relationship('Show', backref='Venues', lazy=True)
 
+    # optimistic locking for concurrent edits, see edit_venue_submission
+    __mapper_args__ = {'version_id_col': version_id}
+
     def __repr__(self):
         return f'<Venue {self.name}: ID {self.id}>'
 
+# the duplicate check matches city and state case-insensitively (see
+# dedupe.similar)
+db.Index('ix_venues_lower_city_state', db.func.lower(Venue.city), db.func.lower(Venue.state))
+
 class Show(db.Model):
     __tablename__ = 'shows'
 
     id = db.Column(db.Integer, primary_key=True)
     venue_id = db.Column(db.Integer, db.ForeignKey('venues.id'))
     artist_id = db.Column(db.Integer, db.ForeignKey('artists.id'))
-    start_time = db.Column(db.DateTime, nullable=False)
+    start_time = db.Column(db.DateTime, nullable=False, index=True)
 
     def __repr__(self):
         return '<Show {}{}>'.format(self.artist_id, self.venue_id)
 
 class Artist(db.Model):
     __tablename__ = 'artists'
+    __table_args__ = (
+        # partial, only the few artists looking for venues (see matching.py)
+        db.Index(
+            'ix_artists_seeking_venue', 'city', 'state',
+            postgresql_where=db.text('seeking_venue'),
+            sqlite_where=db.text('seeking_venue'),
+        ),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String)
+    name = db.Column(db.String, index=True)
     city = db.Column(db.String(120))
     state = db.Column(db.String(120))
     phone = db.Column(db.String(120))
-    genres = db.Column(db.ARRAY(db.String), nullable=False)
+    genres = db.Column(Genres, nullable=False)
     website = db.Column(db.String(120))
     image_link = db.Column(db.String(500))
     facebook_link = db.Column(db.String(120))
     seeking_venue = db.Column(db.Boolean)
     seeking_description = db.Column(db.String(500))
+    version_id = db.Column(db.Integer, nullable=False, server_default='1')
     shows = db.relationship('Show', backref='Artists', lazy=True)
 
+    # optimistic locking for concurrent edits, see edit_artist_submission
+    __mapper_args__ = {'version_id_col': version_id}
+
+    def __repr__(self):
+        return '<Artist {}>'.format(self.name)
+
+db.Index('ix_artists_lower_city_state', db.func.lower(Artist.city), db.func.lower(Artist.state))
+
+# outbox of venue, artist and show writes, inserted in the same
+# transaction as the write itself (see outbox.py)
+class ChangeEvent(db.Model):
+    __tablename__ = 'changes'
+    __table_args__ = (
+        db.Index('ix_changes_entity', 'entity', 'entity_id'),
+        db.Index('ix_changes_txid', 'txid', 'id'),
+    )
+
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    # txid_current() of the writing transaction on PostgreSQL, else 0;
+    # the feed is served in (txid, id) order (see outbox.py)
+    txid = db.Column(db.BigInteger, nullable=False, server_default='0')
+    entity = db.Column(db.String(20), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(10), nullable=False)
+    payload = db.Column(db.JSON)
+    created_at = db.Column(db.DateTime, nullable=False, server_default=db.func.now())
+
+    def __repr__(self):
+        return '<ChangeEvent {} {} {}>'.format(self.op, self.entity, self.entity_id)
+
+# shows per month, venue and artist, and per month and genre, kept up to
+# date by show writes (see reports.py); no foreign keys, so merges and
+# deletes never have to wait on them
+class ShowRollup(db.Model):
+    __tablename__ = 'show_rollups'
+    __table_args__ = (
+        db.Index('ix_show_rollups_venue', 'venue_id', 'month'),
+        db.Index('ix_show_rollups_artist', 'artist_id', 'month'),
+    )
+
+    month = db.Column(db.Date, primary_key=True)
+    venue_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    artist_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    show_count = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return '<ShowRollup {} {}/{}: {}>'.format(self.month, self.venue_id, self.artist_id, self.show_count)
+
+class GenreRollup(db.Model):
+    __tablename__ = 'genre_rollups'
+
+    month = db.Column(db.Date, primary_key=True)
+    genre = db.Column(db.String(120), primary_key=True)
+    show_count = db.Column(db.Integer, nullable=False)
+
     def __repr__(self):
-        return '<Artist {}>'.format(self.name)
\ No newline at end of file
+        return '<GenreRollup {} {}: {}>'.format(self.month, self.genre, self.show_count)
@@ -0,0 +1,161 @@
+'''Change-data-capture feed.
+
+Every flush that writes venues, artists or shows also inserts one row per
+written row into the `changes` table, inside the same transaction, so the
+feed holds exactly the committed writes. GET /api/v1/changes?since=<cursor>
+streams them in order as JSON lines; a consumer keeps the `cursor` of
+the last event it saw and passes it as `since` next time.
+
+On PostgreSQL each event also stores the writing transaction's
+txid_current(), and the feed runs in (txid, id) order up to the xmin
+of the reader's snapshot: every transaction below it has finished, and
+every transaction still to come gets a larger txid, so nothing can
+appear behind a consumer's cursor however late its writer commits. The
+cursor is that (txid, id) pair, "<txid>.<id>", so it doesn't depend on
+its event still being there. The feed always reads the primary; a
+replica's snapshot lags it. Elsewhere (SQLite, one writer at a time)
+txid is 0, and events younger than CHANGES_LAG_SECONDS are held back.
+
+A bare event id, as older consumers send, reads as "0.<id>": nothing
+is skipped, though events may be sent again.
+
+Old events are compacted by `flask compact-changes`: past the retention
+window only the newest event per row is kept, which still carries the
+row's full state (or its deletion), so a consumer that fell behind
+catches up with one event per changed row.'''
+import json
+from datetime import datetime, timedelta
+
+import click
+from flask import Response, jsonify, request, stream_with_context
+from sqlalchemy import and_, exists, func, tuple_
+from sqlalchemy.orm import aliased
+
+import events
+
+ENTITIES = ('venues', 'artists', 'shows')
+
+
+def jsonable(values):
+    return json.loads(json.dumps(values, default=str))
+
+
+def insert_events(connection, table, rows):
+    insert = table.insert()
+    if connection.dialect.name == 'postgresql':
+        insert = insert.values(txid=func.txid_current())
+    connection.execute(insert, rows)
+
+
+def parse_cursor(value):
+    '''(txid, id) from "<txid>.<id>" or a bare id, None if malformed.'''
+    txid, _, id = (value or '0').rpartition('.')
+    try:
+        return int(txid or 0), int(id)
+    except ValueError:
+        return None
+
+
+def format_cursor(txid, id):
+    return '{}.{}'.format(txid, id)
+
+
+def changes_since(db, ChangeEvent, cursor, limit, lag):
+    '''Events after the (txid, id) `cursor`, in feed order (see above).
+    `lag` only applies off PostgreSQL.'''
+    query = (
+        db.session.query(
+            ChangeEvent.txid, ChangeEvent.id, ChangeEvent.entity, ChangeEvent.entity_id,
+            ChangeEvent.op, ChangeEvent.payload, ChangeEvent.created_at,
+        )
+        .filter(tuple_(ChangeEvent.txid, ChangeEvent.id) > tuple_(*cursor))
+    )
+    if db.session.get_bind().dialect.name == 'postgresql':
+        query = query.filter(
+            ChangeEvent.txid < func.txid_snapshot_xmin(func.txid_current_snapshot())
+        )
+    else:
+        query = query.filter(ChangeEvent.created_at <= datetime.now() - timedelta(seconds=lag))
+    return (
+        query.order_by(ChangeEvent.txid, ChangeEvent.id)
+        .limit(limit)
+        .yield_per(500)
+    )
+
+
+def compact(db, ChangeEvent, retention_days):
+    '''Delete events older than the retention window that have a newer
+    event for the same row. Returns the number of deleted events.'''
+    horizon = datetime.now() - timedelta(days=retention_days)
+    newer = aliased(ChangeEvent)
+    superseded = exists().where(and_(
+        newer.entity == ChangeEvent.entity,
+        newer.entity_id == ChangeEvent.entity_id,
+        tuple_(newer.txid, newer.id) > tuple_(ChangeEvent.txid, ChangeEvent.id),
+    ))
+    deleted = (
+        db.session.query(ChangeEvent)
+        .filter(ChangeEvent.created_at < horizon, superseded)
+        .delete(synchronize_session=False)
+    )
+    db.session.commit()
+    return deleted
+
+
+def init_app(app, db, ChangeEvent):
+    table = ChangeEvent.__table__
+
+    @events.on_flush
+    def record(session, changes):
+        rows = [
+            {
+                'entity': change.entity,
+                'entity_id': change.id,
+                'op': change.op,
+                'payload': jsonable(change.values),
+                # same clock as the horizon in changes_since()
+                'created_at': datetime.now(),
+            }
+            for change in changes if change.entity in ENTITIES
+        ]
+        if rows:
+            insert_events(session.connection(), table, rows)
+
+    def feed():
+        cursor = parse_cursor(request.args.get('since'))
+        if cursor is None:
+            return jsonify({'error': 'since must be a cursor from this feed'}), 400
+        limit = max(0, min(
+            request.args.get('limit', 1000, type=int),
+            app.config.get('CHANGES_PAGE_SIZE', 10000),
+        ))
+        rows = changes_since(
+            db, ChangeEvent, cursor, limit, app.config.get('CHANGES_LAG_SECONDS', 2)
+        )
+
+        def generate():
+            for txid, id, entity, entity_id, op, payload, created_at in rows:
+                yield json.dumps({
+                    'id': id,
+                    'cursor': format_cursor(txid, id),
+                    'entity': entity,
+                    'entity_id': entity_id,
+                    'op': op,
+                    'data': payload,
+                    'created_at': created_at.isoformat(),
+                }) + '\n'
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    if not app.config.get('SQLITE_SNAPSHOT'):
+        # the snapshot has no change feed (see snapshot.py); consumers
+        # follow the primary. Not read_only either: a replica's snapshot
+        # lags the primary's, so the cursor could run ahead of it
+        app.add_url_rule('/api/v1/changes', 'changes', feed)
+
+    @app.cli.command('compact-changes')
+    @click.option('--days', default=None, type=int, help='Retention window in days.')
+    def compact_changes(days):
+        '''Drop superseded change events older than the retention window.'''
+        days = days if days is not None else app.config.get('CHANGES_RETENTION_DAYS', 7)
+        click.echo('{} events compacted'.format(compact(db, ChangeEvent, days)))
@@ -0,0 +1,151 @@
+'''Opt-in profiling of live requests.
+
+A request is profiled when it is picked by PROFILE_SAMPLE_RATE or carries
+the PROFILE_HEADER with the PROFILE_TOKEN as its value. Each profiled
+request leaves two files under PROFILE_DIR/<endpoint>/:
+
+  *.pstats      cProfile output, readable with `python -m pstats`
+  *.collapsed   sampled stacks, one "frame;frame;frame count" per line,
+                ready for flamegraph.pl or speedscope
+
+Only the newest PROFILE_MAX_FILES files are kept. `flask profile-report`
+merges them into a top-N report per endpoint.'''
+import cProfile
+import glob
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+import click
+from flask import current_app, g, request
+
+
+class StackSampler(object):
+    '''Samples the stack of one thread at a fixed interval.'''
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.running = False
+
+    def _sample(self):
+        while self.running:
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{} ({}:{})'.format(
+                    code.co_name,
+                    os.path.basename(code.co_filename),
+                    code.co_firstlineno,
+                ))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._sample, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write('{} {}\n'.format(stack, count))
+
+
+def wanted():
+    config = current_app.config
+    token = config.get('PROFILE_TOKEN')
+    if token and request.headers.get(config.get('PROFILE_HEADER', 'X-Profile')) == token:
+        return True
+    rate = config.get('PROFILE_SAMPLE_RATE', 0)
+    return rate > 0 and random.random() < rate
+
+
+def start_profile():
+    if request.endpoint in (None, 'static') or not wanted():
+        return
+    profile = cProfile.Profile()
+    sampler = StackSampler(
+        threading.get_ident(),
+        current_app.config.get('PROFILE_SAMPLE_INTERVAL', 0.005),
+    )
+    sampler.start()
+    profile.enable()
+    g.profile = (profile, sampler, time.time())
+
+
+def finish_profile(exc):
+    started = g.pop('profile', None)
+    if started is None:
+        return
+    profile, sampler, started_at = started
+    profile.disable()
+    sampler.stop()
+
+    config = current_app.config
+    directory = os.path.join(config['PROFILE_DIR'], request.endpoint)
+    os.makedirs(directory, exist_ok=True)
+    name = '{}-{}-{}'.format(
+        time.strftime('%Y%m%dT%H%M%S', time.localtime(started_at)),
+        os.getpid(),
+        uuid.uuid4().hex[:6],
+    )
+    profile.dump_stats(os.path.join(directory, name + '.pstats'))
+    sampler.dump(os.path.join(directory, name + '.collapsed'))
+    rotate(config['PROFILE_DIR'], config.get('PROFILE_MAX_FILES', 500))
+
+
+def rotate(root, max_files):
+    files = glob.glob(os.path.join(root, '*', '*.pstats'))
+    files += glob.glob(os.path.join(root, '*', '*.collapsed'))
+    if len(files) <= max_files:
+        return
+    files.sort(key=os.path.getmtime)
+    for path in files[:len(files) - max_files]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def report(root, top=20, endpoint=None, sort='cumulative', stream=None):
+    stream = stream or sys.stdout
+    endpoints = [endpoint] if endpoint else sorted(os.listdir(root))
+    for name in endpoints:
+        files = glob.glob(os.path.join(root, name, '*.pstats'))
+        if not files:
+            continue
+        stream.write('\n=== {} ({} profiled requests) ===\n'.format(name, len(files)))
+        stats = pstats.Stats(*files, stream=stream)
+        stats.strip_dirs().sort_stats(sort).print_stats(top)
+
+
+def init_app(app):
+    app.config.setdefault('PROFILE_DIR', os.path.join(app.root_path, 'profiles'))
+    app.before_request(start_profile)
+    app.teardown_request(finish_profile)
+
+    @app.cli.command('profile-report')
+    @click.option('--top', default=20, help='Functions to list per endpoint.')
+    @click.option('--endpoint', default=None, help='Only report this endpoint.')
+    @click.option('--sort', default='cumulative',
+                  type=click.Choice(['cumulative', 'tottime', 'ncalls']))
+    def profile_report(top, endpoint, sort):
+        '''Show the hottest functions of the saved request profiles.'''
+        root = app.config['PROFILE_DIR']
+        if not os.path.isdir(root):
+            raise click.ClickException('No profiles in {}'.format(root))
+        report(root, top=top, endpoint=endpoint, sort=sort)
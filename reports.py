@@ -0,0 +1,342 @@
+'''Booking reports from pre-aggregated show counts.
+
+`show_rollups` counts shows per (month, venue, artist) and
+`genre_rollups` per (month, artist genre). Show inserts and deletes
+adjust both tables inside the writing transaction, the same way the
+change feed is written (see outbox.py), so the reports never lag the
+shows; so do updates that move a show to another venue, artist or
+month, including `flask merge`. An update that doesn't carry what the
+row was before marks the rollups stale instead, and a background
+rebuild recomputes them shortly after; a rebuild also runs every
+ROLLUP_REFRESH_SECONDS to pick up genre edits. Every worker runs that
+loop, but an advisory lock lets only one of them rebuild at a time; the
+others skip their turn. `flask rebuild-rollups` backfills them by hand.
+
+The reports at /reports and /api/v1/reports/<name> only read the
+rollups, joined to venues and artists for names and cities.'''
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+import click
+from flask import abort, jsonify, render_template, request
+from sqlalchemy import and_, event, func, select
+from sqlalchemy.dialects import postgresql
+
+import events
+from routing import read_only
+
+logger = logging.getLogger(__name__)
+
+# pg_try_advisory_xact_lock key taken by rebuild(), so that of several
+# workers only one rebuilds at a time
+REBUILD_LOCK = 434301
+
+
+def month_of(value):
+    return date(value.year, value.month, 1)
+
+
+def parse_month(value, default=None):
+    try:
+        return month_of(datetime.strptime(value, '%Y-%m'))
+    except (TypeError, ValueError):
+        return default
+
+
+def add_counts(connection, table, keys, counts):
+    '''Add `counts` ({key tuple: delta}) to the show_count column of
+    `table`, creating the rows that don't exist yet.'''
+    counts = {key: delta for key, delta in counts.items() if delta}
+    if not counts:
+        return
+    columns = [table.c[key] for key in keys]
+    if connection.dialect.name == 'postgresql':
+        insert = postgresql.insert(table)
+        connection.execute(
+            insert.on_conflict_do_update(
+                index_elements=columns,
+                set_={'show_count': table.c.show_count + insert.excluded.show_count},
+            ),
+            [dict(zip(keys, key), show_count=delta) for key, delta in counts.items()],
+        )
+    else:
+        for key, delta in counts.items():
+            updated = connection.execute(
+                table.update()
+                .where(and_(*[column == value for column, value in zip(columns, key)]))
+                .values(show_count=table.c.show_count + delta)
+            )
+            if not updated.rowcount:
+                connection.execute(table.insert().values(dict(zip(keys, key), show_count=delta)))
+    if any(delta < 0 for delta in counts.values()):
+        connection.execute(table.delete().where(table.c.show_count <= 0))
+
+
+def rebuild(db, Show, Artist, ShowRollup, GenreRollup, batch=1000):
+    '''Bring both rollups in line with the shows. Returns the number of
+    show and genre rollups, or None if another rebuild is already
+    running.
+
+    The shows and the current rollups are read from one snapshot, and
+    only the difference is written, as increments like count_shows()
+    makes. Show writes keep going meanwhile: whatever they commit after
+    the snapshot is already counted in the rows the increments land on.'''
+    shows = ShowRollup.__table__
+    genres = GenreRollup.__table__
+    connection = db.session.connection()
+    if connection.dialect.name == 'postgresql':
+        if not connection.execute(
+            select([func.pg_try_advisory_xact_lock(REBUILD_LOCK)])
+        ).scalar():
+            db.session.rollback()
+            return None
+        source = db.engine.connect()
+        snapshot = source.begin()
+        source.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
+    else:
+        # one writer at a time; the session's own transaction will do
+        source, snapshot = connection, None
+
+    show_counts = Counter()
+    genre_counts = Counter()
+    try:
+        rows = source.execution_options(stream_results=True).execute(
+            select([Show.venue_id, Show.artist_id, Show.start_time, Artist.genres])
+            .select_from(Show.__table__.join(Artist.__table__, Show.artist_id == Artist.id))
+            .where(Show.venue_id.isnot(None))
+        )
+        while True:
+            chunk = rows.fetchmany(batch)
+            if not chunk:
+                break
+            for venue_id, artist_id, start_time, artist_genres in chunk:
+                month = month_of(start_time)
+                show_counts[(month, venue_id, artist_id)] += 1
+                for genre in artist_genres or ():
+                    genre_counts[(month, genre)] += 1
+        current = [
+            (table, keys, counts, Counter({
+                tuple(row[:-1]): row[-1]
+                for row in source.execute(select([table.c[key] for key in keys] + [table.c.show_count]))
+            }))
+            for table, keys, counts in (
+                (shows, ('month', 'venue_id', 'artist_id'), show_counts),
+                (genres, ('month', 'genre'), genre_counts),
+            )
+        ]
+    finally:
+        if snapshot is not None:
+            snapshot.rollback()
+            source.close()
+
+    for table, keys, counts, counted in current:
+        add_counts(connection, table, keys, {
+            key: counts[key] - counted[key] for key in set(counts) | set(counted)
+        })
+    db.session.commit()
+    return len(show_counts), len(genre_counts)
+
+
+# Reports
+# ----------------------------------------------------------------------
+
+def venue_months(db, ShowRollup, Venue, since, until, venue_id=None, limit=1000):
+    shows = func.sum(ShowRollup.show_count)
+    query = (
+        db.session.query(Venue.id, Venue.name, Venue.city, Venue.state, ShowRollup.month, shows)
+        .join(Venue, ShowRollup.venue_id == Venue.id)
+        .filter(ShowRollup.month >= since, ShowRollup.month <= until)
+    )
+    if venue_id is not None:
+        query = query.filter(ShowRollup.venue_id == venue_id)
+    rows = (
+        query.group_by(Venue.id, Venue.name, Venue.city, Venue.state, ShowRollup.month)
+        .order_by(ShowRollup.month.desc(), shows.desc())
+        .limit(limit)
+    )
+    return [{
+        'venue_id': id,
+        'venue_name': name,
+        'city': city,
+        'state': state,
+        'month': month.strftime('%Y-%m'),
+        'shows': count,
+    } for id, name, city, state, month, count in rows]
+
+
+def busiest_artists(db, ShowRollup, Venue, Artist, since, until, city=None, state=None, limit=20):
+    shows = func.sum(ShowRollup.show_count)
+    query = (
+        db.session.query(Artist.id, Artist.name, Venue.city, Venue.state, shows)
+        .join(Artist, ShowRollup.artist_id == Artist.id)
+        .join(Venue, ShowRollup.venue_id == Venue.id)
+        .filter(ShowRollup.month >= since, ShowRollup.month <= until)
+    )
+    if city:
+        query = query.filter(func.lower(Venue.city) == city.strip().lower())
+    if state:
+        query = query.filter(func.lower(Venue.state) == state.strip().lower())
+    rows = (
+        query.group_by(Artist.id, Artist.name, Venue.city, Venue.state)
+        .order_by(shows.desc(), Artist.name)
+        .limit(limit)
+    )
+    return [{
+        'artist_id': id,
+        'artist_name': name,
+        'city': city,
+        'state': state,
+        'shows': count,
+    } for id, name, city, state, count in rows]
+
+
+def genre_trends(db, GenreRollup, since, until):
+    rows = (
+        db.session.query(GenreRollup.month, GenreRollup.genre, GenreRollup.show_count)
+        .filter(GenreRollup.month >= since, GenreRollup.month <= until)
+        .order_by(GenreRollup.month, GenreRollup.show_count.desc())
+    )
+    return [
+        {'month': month.strftime('%Y-%m'), 'genre': genre, 'shows': count}
+        for month, genre, count in rows
+    ]
+
+
+def init_app(app, db, Venue, Artist, Show, ShowRollup, GenreRollup):
+    artists = Artist.__table__
+    stale = threading.Event()
+
+    @events.on_flush
+    def count_shows(session, changes):
+        counted = []
+        for change in changes:
+            if change.entity != 'shows':
+                continue
+            if change.op == 'insert':
+                counted.append((change.values, 1))
+            elif change.op == 'delete':
+                counted.append((change.values, -1))
+            elif change.old is None:
+                session.info['rollups_stale'] = True
+            elif any(key in change.old for key in ('venue_id', 'artist_id', 'start_time')):
+                # moved (e.g. by dedupe.merge): out of the old key, into the new
+                counted.append((dict(change.values, **change.old), -1))
+                counted.append((change.values, 1))
+
+        show_counts = Counter()
+        added = []
+        for values, step in counted:
+            if values.get('venue_id') is None or values.get('artist_id') is None:
+                continue
+            month = month_of(values['start_time'])
+            show_counts[(month, values['venue_id'], values['artist_id'])] += step
+            added.append((month, values['artist_id'], step))
+        if not added:
+            return
+
+        connection = session.connection()
+        genres_of = dict(connection.execute(
+            select([artists.c.id, artists.c.genres])
+            .where(artists.c.id.in_({artist_id for _, artist_id, _ in added}))
+        ).fetchall())
+        genre_counts = Counter()
+        for month, artist_id, step in added:
+            for genre in genres_of.get(artist_id) or ():
+                genre_counts[(month, genre)] += step
+
+        add_counts(connection, ShowRollup.__table__, ('month', 'venue_id', 'artist_id'), show_counts)
+        add_counts(connection, GenreRollup.__table__, ('month', 'genre'), genre_counts)
+
+    @event.listens_for(db.session, 'after_commit')
+    def rebuild_if_stale(session):
+        if session.info.pop('rollups_stale', False):
+            stale.set()
+
+    @event.listens_for(db.session, 'after_rollback')
+    def discard_stale(session):
+        session.info.pop('rollups_stale', None)
+
+    def refresh():
+        with app.app_context():
+            try:
+                rebuild(db, Show, Artist, ShowRollup, GenreRollup)
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f'Could not rebuild the show rollups -- {e}')
+            finally:
+                db.session.remove()
+
+    def run():
+        interval = app.config.get('ROLLUP_REFRESH_SECONDS', 86400)
+        while True:
+            # the rollups are already current at startup; rebuild on
+            # schedule, or soon after a write that couldn't be counted
+            stale.wait(interval)
+            stale.clear()
+            time.sleep(app.config.get('ROLLUP_REBUILD_DELAY', 5))
+            refresh()
+
+    @app.before_first_request
+    def start_rollups():
+        if app.config.get('SQLITE_SNAPSHOT'):
+            # read-only snapshot, the rollups came with it
+            return
+        if not app.config.get('BACKGROUND_THREADS', True):
+            return
+        threading.Thread(target=run, name='rollups', daemon=True).start()
+
+    def report_args():
+        today = month_of(datetime.now())
+        until = parse_month(request.args.get('until'), today)
+        since = parse_month(
+            request.args.get('since'),
+            month_of(until - timedelta(days=365)),
+        )
+        return since, until
+
+    def run_report(name):
+        since, until = report_args()
+        if name == 'venue-months':
+            return venue_months(
+                db, ShowRollup, Venue, since, until,
+                venue_id=request.args.get('venue_id', type=int),
+            )
+        if name == 'busiest-artists':
+            return busiest_artists(
+                db, ShowRollup, Venue, Artist, since, until,
+                city=request.args.get('city'), state=request.args.get('state'),
+                limit=min(request.args.get('limit', 20, type=int), 100),
+            )
+        if name == 'genre-trends':
+            return genre_trends(db, GenreRollup, since, until)
+        abort(404)
+
+    def api(name):
+        return jsonify({'data': run_report(name)})
+
+    def page():
+        since, until = report_args()
+        return render_template(
+            'pages/reports.html',
+            since=since.strftime('%Y-%m'),
+            until=until.strftime('%Y-%m'),
+            city=request.args.get('city'),
+            state=request.args.get('state'),
+            venue_months=run_report('venue-months'),
+            busiest_artists=run_report('busiest-artists'),
+            genre_trends=run_report('genre-trends'),
+        )
+
+    app.add_url_rule('/api/v1/reports/<name>', 'report_api', read_only(api))
+    app.add_url_rule('/reports', 'reports', read_only(page))
+
+    @app.cli.command('rebuild-rollups')
+    def rebuild_rollups():
+        '''Recompute the show and genre rollups from the shows.'''
+        counts = rebuild(db, Show, Artist, ShowRollup, GenreRollup)
+        if counts is None:
+            raise click.ClickException('another rebuild is running')
+        click.echo('{} show rollups, {} genre rollups'.format(*counts))
@@ -0,0 +1,95 @@
+import itertools
+import time
+from functools import wraps
+from threading import Lock
+
+from flask import g, has_request_context, request
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import create_engine, orm
+
+import events
+
+# Set on the response after a write so the same client keeps reading
+# from the primary until replication has caught up.
+PRIMARY_COOKIE = 'fyyur_primary_until'
+
+
+class ReplicaPool(object):
+    '''Engines for the read replicas and the policy picking one of them:
+    'round_robin' or 'least_connections' (fewest checked out).'''
+
+    def __init__(self, uris, selection='round_robin', engine_options=None):
+        self.engines = [create_engine(uri, **(engine_options or {})) for uri in uris]
+        self.selection = selection
+        self._next = itertools.cycle(range(len(self.engines)))
+        self.lock = Lock()
+
+    def choose(self):
+        if self.selection == 'least_connections':
+            return min(self.engines, key=lambda engine: engine.pool.checkedout())
+        with self.lock:
+            return self.engines[next(self._next)]
+
+
+def _reading():
+    return has_request_context() and g.get('read_only', False)
+
+
+class RoutingSession(SignallingSession):
+    '''Sends the queries of read-only requests to a replica. The replica is
+    picked once per session, so one request sees one consistent snapshot;
+    anything that flushes still goes to the primary.'''
+
+    def get_bind(self, mapper=None, clause=None):
+        replicas = self.app.extensions.get('replicas')
+        if replicas and replicas.engines and not self._flushing and _reading():
+            engine = self.info.get('replica')
+            if engine is None:
+                engine = self.info['replica'] = replicas.choose()
+            return engine
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def read_only(f):
+    '''Mark a view as safe to serve from a replica. Clients that wrote
+    within READ_YOUR_WRITES_SECONDS are kept on the primary.'''
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        try:
+            primary_until = float(request.cookies.get(PRIMARY_COOKIE, 0))
+        except ValueError:
+            primary_until = 0
+        g.read_only = primary_until < time.time()
+        return f(*args, **kwargs)
+    decorated.read_only = True
+    return decorated
+
+
+def init_app(app):
+    replicas = ReplicaPool(
+        app.config.get('SQLALCHEMY_REPLICA_URIS', []),
+        selection=app.config.get('REPLICA_SELECTION', 'round_robin'),
+        engine_options=app.config.get('SQLALCHEMY_ENGINE_OPTIONS'),
+    )
+    window = app.config.get('READ_YOUR_WRITES_SECONDS', 5)
+
+    @events.subscribe
+    def note_write(changes):
+        if has_request_context():
+            g.wrote = True
+
+    @app.after_request
+    def stick_to_primary(response):
+        if replicas.engines and g.get('wrote'):
+            response.set_cookie(
+                PRIMARY_COOKIE, str(time.time() + window), max_age=window
+            )
+        return response
+
+    app.extensions['replicas'] = replicas
+    return replicas
@@ -0,0 +1,90 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+import events
+
+
+def normalize(term):
+    return ' '.join((term or '').lower().split())
+
+
+class SearchCache(object):
+    '''LRU of search results with a TTL, keyed by (entity, normalized
+    term). Only ids and names are kept, which is all the result pages
+    show.
+
+    A write evicts just the entries it could change: those whose term
+    occurs in the written name (the row may now match) and those that
+    already list the row (its name changed or it is gone).'''
+
+    def __init__(self, maxsize=1000, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, entity, term):
+        key = (entity, normalize(term))
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self.entries.pop(key, None)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, entity, term, results):
+        key = (entity, normalize(term))
+        ids = frozenset(result['id'] for result in results)
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, results, ids)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def fetch(self, entity, term, load):
+        '''Cached results for `term`, calling `load(term)` on a miss.'''
+        results = self.get(entity, term)
+        if results is None:
+            results = load(term)
+            self.set(entity, term, results)
+        return results
+
+    def invalidate(self, entity, id, name):
+        # without the name (e.g. a trimmed notification from another
+        # worker) any entry of the entity may be affected
+        name = normalize(name) if name is not None else None
+        with self.lock:
+            for key, (expires, results, ids) in list(self.entries.items()):
+                cached_entity, term = key
+                if cached_entity != entity:
+                    continue
+                # % and _ are wildcards to ILIKE; don't try to be clever
+                wildcard = '%' in term or '_' in term
+                if name is None or id in ids or wildcard or term in name:
+                    del self.entries[key]
+
+    def on_commit(self, changes):
+        for change in changes:
+            if change.entity in ('venues', 'artists'):
+                self.invalidate(change.entity, change.id, change.values.get('name'))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+def init_app(app):
+    cache = SearchCache(
+        maxsize=app.config.get('SEARCH_CACHE_SIZE', 1000),
+        ttl=app.config.get('SEARCH_CACHE_TTL', 60),
+    )
+    events.subscribe(cache.on_commit)
+    events.on_reset(cache.clear)
+    app.extensions['search_cache'] = cache
+    return cache
@@ -0,0 +1,273 @@
+'''Server-sent events of new and changed upcoming shows.
+
+Each worker has one ShowFanout. Committed show writes (local, or from
+other workers through invalidation.py) are queued to its single thread,
+which loads the details of the whole batch with one query and formats
+each event once; every connected client then just gets the same string
+put on its queue, if it matches the client's city / state / genre
+filters. Clients never query the database, and an idle client costs a
+blocked generator and an empty queue. With threaded workers each open
+stream also holds a worker thread, hence the small default
+SHOW_STREAM_MAX_CLIENTS; under gevent (see config.py) they are greenlets
+and thousands of idle connections are cheap.
+
+Edits to a venue or artist reload its upcoming shows too. A client is
+sent `removed` for a show that is no longer upcoming, or that an edit
+moved out of its city / state / genre filters.
+
+Clients that fall SHOW_STREAM_QUEUE_SIZE events behind are dropped, and
+reconnect on their own (the stream sets `retry`). Every event has an
+`id` ("<worker>:<seq>"), and the worker keeps its last
+SHOW_STREAM_REPLAY events, so a client that reconnects with
+Last-Event-ID is first sent what it missed. If it can't be (it was
+connected to another worker, or fell further behind) it gets `reset`
+instead, and should reload the shows and carry on from there.'''
+import json
+import logging
+import queue
+import threading
+import uuid
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy import or_
+
+import events
+
+logger = logging.getLogger(__name__)
+
+
+def format_event(name, payload):
+    return 'event: {}\ndata: {}\n\n'.format(name, json.dumps(payload, default=str))
+
+
+def removal(id):
+    return format_event('removed', {'id': id})
+
+
+def with_id(id, message):
+    return 'id: {}\n{}'.format(id, message)
+
+
+class Client(object):
+    def __init__(self, city=None, state=None, genre=None, queue_size=100):
+        self.city = (city or '').strip().lower() or None
+        self.state = (state or '').strip().lower() or None
+        self.genre = (genre or '').strip().lower() or None
+        self.queue = queue.Queue(queue_size)
+        self.dropped = False
+        self.last_event_id = None
+
+    def wants(self, show):
+        if show is None:
+            # removals carry no details; let every client drop the id
+            return True
+        if self.city and (show['city'] or '').lower() != self.city:
+            return False
+        if self.state and (show['state'] or '').lower() != self.state:
+            return False
+        if self.genre and self.genre not in (g.lower() for g in show['genres'] or ()):
+            return False
+        return True
+
+
+class ShowFanout(object):
+    def __init__(self, load, max_clients=50, queue_size=100, replay_size=100):
+        self.load = load
+        self.max_clients = max_clients
+        self.queue_size = queue_size
+        self.clients = set()
+        self.lock = threading.Lock()
+        self.pending = queue.Queue()
+        self.thread = None
+        self.origin = uuid.uuid4().hex[:8]
+        self.seq = 0
+        # (seq, show, message, otherwise), as put on the clients
+        self.replay = deque(maxlen=replay_size)
+
+    def event_id(self, seq):
+        return '{}:{}'.format(self.origin, seq)
+
+    def missed(self, last_event_id):
+        '''The replay entries after `last_event_id`, None if they aren't
+        all still here.'''
+        origin, _, seq = (last_event_id or '').partition(':')
+        if origin != self.origin or not seq.isdigit():
+            return None
+        seq = int(seq)
+        if not self.seq - len(self.replay) <= seq <= self.seq:
+            return None
+        return [entry for entry in self.replay if entry[0] > seq]
+
+    def subscribe(self, city=None, state=None, genre=None, last_event_id=None):
+        with self.lock:
+            if len(self.clients) >= self.max_clients:
+                return None
+            client = Client(city, state, genre, self.queue_size)
+            client.last_event_id = self.event_id(self.seq)
+            if last_event_id:
+                missed = self.missed(last_event_id)
+                if missed is None or len(missed) >= self.queue_size:
+                    client.queue.put_nowait(with_id(client.last_event_id, format_event('reset', {})))
+                else:
+                    self.deliver(client, missed)
+            # under the lock, so broadcast() can't slip in between
+            self.clients.add(client)
+        self.start()
+        return client
+
+    def unsubscribe(self, client):
+        with self.lock:
+            self.clients.discard(client)
+
+    def on_commit(self, changes):
+        # runs in the committing request; hand off and return. Once
+        # anyone has subscribed, keep numbering events even with no one
+        # connected: a client may be about to reconnect for them
+        if self.thread is None:
+            return
+        for change in changes:
+            if change.entity == 'shows' or (
+                change.entity in ('venues', 'artists') and change.op == 'update'
+            ):
+                self.pending.put((change.entity, change.id, change.op))
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.thread = threading.Thread(target=self.run, name='show-stream', daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while True:
+            batch = [self.pending.get()]
+            while True:
+                try:
+                    batch.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.dispatch(batch)
+            except Exception as e:
+                logger.error(f'Could not fan out show updates -- {e}')
+
+    def dispatch(self, batch):
+        def ids(entity, *ops):
+            return {id for e, id, op in batch if e == entity and (not ops or op in ops)}
+
+        removed = ids('shows', 'delete')
+        inserted = ids('shows', 'insert') - removed
+        changed = ids('shows', 'insert', 'update') - removed
+        venues, artists = ids('venues'), ids('artists')
+        messages = [(None, removal(id), None) for id in sorted(removed)]
+        if changed or venues or artists:
+            found = set()
+            for show in self.load(sorted(changed), sorted(venues), sorted(artists)):
+                found.add(show['id'])
+                # an edited show may have left a client's filters
+                otherwise = None if show['id'] in inserted else removal(show['id'])
+                messages.append((show, format_event('show', show), otherwise))
+            # in the past now, or its venue / artist is gone
+            messages += [(None, removal(id), None) for id in sorted(changed - inserted - found)]
+        if messages:
+            self.broadcast(messages)
+
+    def broadcast(self, messages):
+        '''Number each (show, message, otherwise) and put it on the
+        clients that want `show`, and `otherwise` (if any) on the rest.'''
+        entries = []
+        with self.lock:
+            for show, message, otherwise in messages:
+                self.seq += 1
+                id = self.event_id(self.seq)
+                entries.append((
+                    self.seq, show, with_id(id, message),
+                    with_id(id, otherwise) if otherwise is not None else None,
+                ))
+            self.replay.extend(entries)
+            clients = list(self.clients)
+        for client in clients:
+            self.deliver(client, entries)
+
+    def deliver(self, client, entries):
+        try:
+            for seq, show, message, otherwise in entries:
+                if client.wants(show):
+                    client.queue.put_nowait(message)
+                elif otherwise is not None:
+                    client.queue.put_nowait(otherwise)
+        except queue.Full:
+            # too slow; let it reconnect rather than buffer for it
+            self.unsubscribe(client)
+            client.dropped = True
+
+    def stream(self, client, heartbeat=15, retry=5000):
+        try:
+            # the id marks where a reconnect should resume, even before
+            # the first event
+            yield 'retry: {}\nid: {}\n\n'.format(retry, client.last_event_id)
+            while True:
+                try:
+                    message = client.queue.get(timeout=heartbeat)
+                except queue.Empty:
+                    # keeps proxies from closing the idle connection
+                    yield ': keepalive\n\n'
+                    continue
+                if client.dropped:
+                    return
+                yield message
+        finally:
+            self.unsubscribe(client)
+
+
+def load_upcoming(db, Venue, Artist, Show, ids, venue_ids=(), artist_ids=()):
+    '''Details of the shows in `ids`, and of the shows of `venue_ids` and
+    `artist_ids`, that haven't started yet, from one query.'''
+    wanted = [
+        column.in_(values)
+        for column, values in ((Show.id, ids), (Show.venue_id, venue_ids), (Show.artist_id, artist_ids))
+        if values
+    ]
+    rows = (
+        db.session.query(
+            Show.id, Show.start_time, Show.venue_id, Venue.name, Venue.city,
+            Venue.state, Show.artist_id, Artist.name, Artist.image_link, Artist.genres,
+        )
+        .join(Venue, Show.venue_id == Venue.id)
+        .join(Artist, Show.artist_id == Artist.id)
+        .filter(or_(*wanted), Show.start_time >= datetime.now())
+        .order_by(Show.start_time)
+    )
+    return [{
+        'id': id,
+        'start_time': str(start_time),
+        'venue_id': venue_id,
+        'venue_name': venue_name,
+        'city': city,
+        'state': state,
+        'artist_id': artist_id,
+        'artist_name': artist_name,
+        'artist_image_link': artist_image_link,
+        'genres': list(genres or ()),
+    } for id, start_time, venue_id, venue_name, city, state, artist_id,
+        artist_name, artist_image_link, genres in rows]
+
+
+def init_app(app, db, Venue, Artist, Show):
+    def load(ids, venue_ids, artist_ids):
+        with app.app_context():
+            try:
+                return load_upcoming(db, Venue, Artist, Show, ids, venue_ids, artist_ids)
+            finally:
+                db.session.remove()
+
+    fanout = ShowFanout(
+        load,
+        max_clients=app.config.get('SHOW_STREAM_MAX_CLIENTS', 50),
+        queue_size=app.config.get('SHOW_STREAM_QUEUE_SIZE', 100),
+        replay_size=app.config.get('SHOW_STREAM_REPLAY', 100),
+    )
+    events.subscribe(fanout.on_commit)
+    app.extensions['show_stream'] = fanout
+    return fanout
@@ -0,0 +1,180 @@
+'''Slow-query log.
+
+Every statement slower than SLOW_QUERY_SECONDS is written as one JSON
+line to SLOW_QUERY_LOG (rotated like error.log's neighbours), with its
+fingerprint, parameters, duration and the route that ran it. For a
+sample of slow SELECTs on PostgreSQL the line also carries the output of
+EXPLAIN (ANALYZE, BUFFERS). ANALYZE runs the statement a second time, so
+SELECTs that do more than read tables (advisory locks, txid_current(),
+nextval(), pg_notify(), FOR UPDATE, ...) only get a plain EXPLAIN.
+`flask slow-queries` groups the log by fingerprint.'''
+import glob
+import json
+import logging
+import random
+import re
+import time
+from collections import defaultdict
+from logging.handlers import RotatingFileHandler
+
+import click
+from flask import has_request_context, request
+from sqlalchemy import event
+
+logger = logging.getLogger('fyyur.slow_queries')
+
+_strings = re.compile(r"'(?:[^']|'')*'")
+_numbers = re.compile(r'\b\d+(?:\.\d+)?\b')
+_params = re.compile(r'%\(\w+\)s|%s|\?|:\w+')
+_lists = re.compile(r'\((?:\s*\?\s*,)+\s*\?\s*\)')
+_spaces = re.compile(r'\s+')
+_from = re.compile(r'\bFROM\b', re.I)
+_side_effects = re.compile(
+    r'\b(?:pg_(?:try_)?advisory\w*|txid_current|pg_current_xact_id|nextval|setval'
+    r'|pg_notify|set_config|pg_sleep\w*|lo_\w+|dblink\w*)\s*\('
+    r'|\bFOR\s+(?:NO\s+KEY\s+)?(?:UPDATE|SHARE|KEY\s+SHARE)\b',
+    re.I,
+)
+
+
+def fingerprint(statement):
+    '''Statement with literals and parameters replaced by "?", so
+    different executions of one query group together.'''
+    sql = _strings.sub('?', statement)
+    sql = _params.sub('?', sql)
+    sql = _numbers.sub('?', sql)
+    sql = _lists.sub('(?)', sql)
+    return _spaces.sub(' ', sql).strip()
+
+
+def read_only(statement):
+    '''Whether running `statement` again only reads tables.'''
+    return bool(_from.search(statement)) and not _side_effects.search(statement)
+
+
+def explain(cursor, statement, parameters):
+    '''EXPLAIN the statement inside a savepoint, so a failure can't abort
+    the caller's transaction; with (ANALYZE, BUFFERS) if it is
+    read_only().'''
+    raw = cursor.connection
+    options = '(ANALYZE, BUFFERS) ' if read_only(statement) else ''
+    with raw.cursor() as explain_cursor:
+        explain_cursor.execute('SAVEPOINT slow_query_explain')
+        try:
+            explain_cursor.execute(
+                'EXPLAIN ' + options + statement, parameters
+            )
+            plan = [row[0] for row in explain_cursor.fetchall()]
+        finally:
+            explain_cursor.execute('ROLLBACK TO SAVEPOINT slow_query_explain')
+    return plan
+
+
+class SlowQueryLog(object):
+    def __init__(self, threshold=0.2, explain_rate=0.1):
+        self.threshold = threshold
+        self.explain_rate = explain_rate
+
+    def before(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('slow_query_started', []).append(time.perf_counter())
+
+    def after(self, conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - conn.info['slow_query_started'].pop()
+        if duration < self.threshold:
+            return
+
+        record = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'duration': round(duration, 6),
+            'route': request.endpoint if has_request_context() else None,
+            'fingerprint': fingerprint(statement),
+            'statement': statement,
+            'parameters': repr(parameters)[:1000],
+        }
+        if (
+            conn.dialect.name == 'postgresql'
+            and not executemany
+            and statement.lstrip().upper().startswith('SELECT')
+            and random.random() < self.explain_rate
+        ):
+            try:
+                record['plan'] = explain(cursor, statement, parameters)
+            except Exception as e:
+                record['plan_error'] = str(e)
+        logger.warning(json.dumps(record, default=str))
+
+    def failed(self, exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get('slow_query_started'):
+            conn.info['slow_query_started'].pop()
+
+    def watch(self, engine):
+        event.listen(engine, 'before_cursor_execute', self.before)
+        event.listen(engine, 'after_cursor_execute', self.after)
+        event.listen(engine, 'handle_error', self.failed)
+
+
+def summarize(paths, top=20):
+    groups = defaultdict(lambda: {'durations': [], 'routes': set(), 'plans': 0})
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                group = groups[record['fingerprint']]
+                group['durations'].append(record['duration'])
+                group['routes'].add(record.get('route') or '-')
+                group['plans'] += 'plan' in record
+
+    summary = []
+    for sql, group in groups.items():
+        durations = sorted(group['durations'])
+        summary.append({
+            'fingerprint': sql,
+            'count': len(durations),
+            'total': sum(durations),
+            'mean': sum(durations) / len(durations),
+            'p95': durations[int(0.95 * (len(durations) - 1))],
+            'max': durations[-1],
+            'routes': sorted(group['routes']),
+            'plans': group['plans'],
+        })
+    summary.sort(key=lambda s: s['total'], reverse=True)
+    return summary[:top]
+
+
+def init_app(app, engines):
+    path = app.config.get('SLOW_QUERY_LOG', 'slow_queries.log')
+    handler = RotatingFileHandler(
+        path,
+        maxBytes=app.config.get('SLOW_QUERY_LOG_BYTES', 10 * 1024 * 1024),
+        backupCount=app.config.get('SLOW_QUERY_LOG_BACKUPS', 5),
+    )
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.WARNING)
+    logger.propagate = False
+
+    log = SlowQueryLog(
+        threshold=app.config.get('SLOW_QUERY_SECONDS', 0.2),
+        explain_rate=app.config.get('SLOW_QUERY_EXPLAIN_RATE', 0.1),
+    )
+    for engine in engines:
+        log.watch(engine)
+
+    @app.cli.command('slow-queries')
+    @click.option('--top', default=20, help='Statements to list.')
+    def slow_queries(top):
+        '''Summarize the slow-query log by statement fingerprint.'''
+        paths = sorted(glob.glob(path + '*'))
+        for s in summarize(paths, top=top):
+            click.echo(
+                '{count:6d} calls  total {total:9.3f}s  mean {mean:7.3f}s  '
+                'p95 {p95:7.3f}s  max {max:7.3f}s  plans {plans}'.format(**s)
+            )
+            click.echo('        routes: {}'.format(', '.join(s['routes'])))
+            click.echo('        {}\n'.format(s['fingerprint']))
+
+    return log
@@ -0,0 +1,123 @@
+'''Read-only SQLite snapshot of the catalog, for edge nodes and tests.
+
+`flask snapshot-sqlite OUT` copies venues, artists, shows and the report
+rollups from the configured database into a new SQLite file, with the
+same indexes as the models (genres become JSON lists, see models.py),
+then ANALYZEs and VACUUMs it. The file is built next to OUT and renamed
+into place, so edge workers reading the old file never see a partial
+one. On PostgreSQL every table is read in one REPEATABLE READ
+transaction, so the copy is a single consistent point in time.
+
+Point edge workers at the file with FYYUR_SQLITE=OUT (see config.py);
+they open it read-only and immutable. The change feed isn't copied,
+and an edge node refuses writes: both belong to the primary.
+
+A file is never changed in place, only replaced, which is what makes
+`immutable` safe: connections already open keep reading the old inode.
+Workers check the path before each request, and when a new file has
+been renamed over it they drop their pooled connections and reset
+everything cached from the old one (events.reset()), since no commits
+will ever tell them what changed.'''
+import os
+import threading
+
+import click
+from flask import abort, request
+from sqlalchemy import create_engine
+
+import events
+
+# copied in this order, so foreign keys always point at copied rows
+TABLES = ('venues', 'artists', 'shows', 'show_rollups', 'genre_rollups')
+
+
+def snapshot(db, out, batch=1000):
+    '''Write the catalog to the SQLite file `out`. Returns {table: rows}.'''
+    tmp = out + '.tmp'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    target = create_engine('sqlite:///' + tmp)
+    tables = [db.metadata.tables[name] for name in TABLES]
+    db.metadata.create_all(target, tables=tables)
+
+    counts = {}
+    source = db.engine.connect()
+    transaction = source.begin()
+    try:
+        if source.dialect.name == 'postgresql':
+            source.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
+        with target.begin() as connection:
+            for table in tables:
+                counts[table.name] = 0
+                rows = source.execution_options(stream_results=True).execute(
+                    table.select().order_by(*table.primary_key.columns)
+                )
+                while True:
+                    chunk = rows.fetchmany(batch)
+                    if not chunk:
+                        break
+                    connection.execute(table.insert(), [dict(row) for row in chunk])
+                    counts[table.name] += len(chunk)
+    finally:
+        transaction.rollback()
+        source.close()
+
+    with target.connect() as connection:
+        connection.execute('ANALYZE')
+        connection.execute('VACUUM')
+    target.dispose()
+    os.replace(tmp, out)
+    return counts
+
+
+class SnapshotWatcher(object):
+    '''Tells when the file at `path` has been replaced since the last
+    check.'''
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.stamp = self._stamp()
+
+    def _stamp(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def changed(self):
+        stamp = self._stamp()
+        with self.lock:
+            if stamp == self.stamp:
+                return False
+            self.stamp = stamp
+            return True
+
+
+def init_app(app, db):
+    if app.config.get('SQLITE_SNAPSHOT'):
+        watcher = SnapshotWatcher(app.config['SQLITE_SNAPSHOT'])
+
+        @app.before_request
+        def reload_snapshot():
+            if watcher.changed():
+                db.engine.dispose()
+                # reloading the caches takes a while; this request and
+                # the ones during the reload still get the old data
+                threading.Thread(target=events.reset, name='snapshot-reload', daemon=True).start()
+
+        @app.before_request
+        def refuse_writes():
+            view = app.view_functions.get(request.endpoint)
+            if request.method not in ('GET', 'HEAD', 'OPTIONS') and not getattr(view, 'read_only', False):
+                abort(405)
+
+    @app.cli.command('snapshot-sqlite')
+    @click.argument('out')
+    def snapshot_sqlite(out):
+        '''Copy the catalog into a read-only SQLite file OUT.'''
+        counts = snapshot(db, out, app.config.get('STREAM_YIELD_PER', 1000))
+        for name in TABLES:
+            click.echo('{:>14} {}'.format(name, counts[name]))
+        click.echo('serve it with FYYUR_SQLITE={}'.format(os.path.abspath(out)))
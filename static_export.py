@@ -0,0 +1,161 @@
+'''Static snapshot of the public pages, for serving from a CDN.
+
+`flask export-static` renders the venue, artist and show listings and
+every venue and artist page through the normal views into
+EXPORT_DIR/<path>/index.html, spread over a process pool.
+
+EXPORT_DIR/manifest.json records a signature per page, built from the
+version_id of every venue and artist on it and the shows it lists
+(including whether each show is still upcoming). Later runs compare
+signatures and only re-render pages whose data changed; pages of deleted
+venues and artists are removed.'''
+import hashlib
+import importlib
+import json
+import os
+import shutil
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import click
+
+_client = None
+
+
+def signature(items):
+    return hashlib.sha1(repr(sorted(map(repr, items))).encode('utf-8')).hexdigest()
+
+
+def page_signatures(db, Venue, Artist, Show):
+    '''Map of page path to signature, from three queries over ids and
+    versions only.'''
+    now = datetime.now()
+    venues = db.session.query(Venue.id, Venue.version_id).all()
+    artists = db.session.query(Artist.id, Artist.version_id).all()
+    shows = (
+        db.session.query(
+            Show.id, Show.venue_id, Show.artist_id, Show.start_time,
+            Venue.version_id, Artist.version_id,
+        )
+        .join(Venue, Show.venue_id == Venue.id)
+        .join(Artist, Show.artist_id == Artist.id)
+        .all()
+    )
+
+    venue_shows = defaultdict(list)
+    artist_shows = defaultdict(list)
+    for id, venue_id, artist_id, start_time, venue_version, artist_version in shows:
+        upcoming = start_time >= now
+        venue_shows[venue_id].append((id, str(start_time), upcoming, artist_id, artist_version))
+        artist_shows[artist_id].append((id, str(start_time), upcoming, venue_id, venue_version))
+
+    pages = {
+        '/venues': signature(venues),
+        '/artists': signature(artists),
+        '/shows': signature(
+            (id, venue_id, artist_id, str(start_time), venue_version, artist_version)
+            for id, venue_id, artist_id, start_time, venue_version, artist_version in shows
+        ),
+    }
+    for id, version in venues:
+        pages['/venues/{}'.format(id)] = signature([('venue', version)] + venue_shows[id])
+    for id, version in artists:
+        pages['/artists/{}'.format(id)] = signature([('artist', version)] + artist_shows[id])
+    return pages
+
+
+def page_file(out, path):
+    return os.path.join(out, path.strip('/'), 'index.html')
+
+
+def _init_worker(import_name):
+    global _client
+    module = importlib.import_module(import_name)
+    # connections inherited over fork must not be shared with the parent
+    module.db.engine.dispose()
+    # a short-lived renderer: no refresh threads or LISTEN per worker
+    module.app.config['BACKGROUND_THREADS'] = False
+    _client = module.app.test_client()
+
+
+def _render(job):
+    path, out = job
+    response = _client.get(path)
+    if response.status_code != 200:
+        return path, response.status_code
+    target = page_file(out, path)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp = target + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(response.get_data())
+    os.replace(tmp, target)
+    return path, 200
+
+
+def load_manifest(out):
+    try:
+        with open(os.path.join(out, 'manifest.json')) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def save_manifest(out, manifest):
+    path = os.path.join(out, 'manifest.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def export(app, db, Venue, Artist, Show, out, workers=None, full=False):
+    os.makedirs(out, exist_ok=True)
+    with app.app_context():
+        pages = page_signatures(db, Venue, Artist, Show)
+        db.session.remove()
+    db.engine.dispose()
+
+    manifest = {} if full else load_manifest(out)
+    stale = sorted(path for path, sig in pages.items() if manifest.get(path) != sig)
+    gone = sorted(set(manifest) - set(pages))
+
+    failed = []
+    if stale:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(app.import_name,),
+        ) as pool:
+            jobs = [(path, out) for path in stale]
+            for path, status in pool.map(_render, jobs, chunksize=16):
+                if status == 200:
+                    manifest[path] = pages[path]
+                else:
+                    failed.append((path, status))
+
+    for path in gone:
+        manifest.pop(path, None)
+        shutil.rmtree(os.path.dirname(page_file(out, path)), ignore_errors=True)
+
+    if app.static_folder and os.path.isdir(app.static_folder):
+        shutil.copytree(app.static_folder, os.path.join(out, 'static'), dirs_exist_ok=True)
+    save_manifest(out, manifest)
+    return stale, gone, failed
+
+
+def init_app(app, db, Venue, Artist, Show):
+    @app.cli.command('export-static')
+    @click.option('--out', default=None, help='Target directory (EXPORT_DIR).')
+    @click.option('--workers', default=None, type=int, help='Render processes.')
+    @click.option('--full', is_flag=True, help='Ignore the manifest, render everything.')
+    def export_static(out, workers, full):
+        '''Render the public pages into a static directory.'''
+        out = out or app.config['EXPORT_DIR']
+        stale, gone, failed = export(
+            app, db, Venue, Artist, Show, out, workers=workers, full=full
+        )
+        click.echo('{} pages rendered, {} removed, {} failed'.format(
+            len(stale) - len(failed), len(gone), len(failed)
+        ))
+        for path, status in failed:
+            click.echo('  {} -> {}'.format(path, status))
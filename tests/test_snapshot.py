@@ -0,0 +1,69 @@
+'''Runs on a writable SQLite file, no PostgreSQL needed.'''
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DIRECTORY = tempfile.mkdtemp()
+os.environ['FYYUR_DATABASE_URI'] = 'sqlite:///' + os.path.join(DIRECTORY, 'fyyur.db')
+os.environ.pop('FYYUR_SQLITE', None)
+
+import app as fyyur
+from snapshot import SnapshotWatcher, snapshot
+
+
+class SnapshotTest(unittest.TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(DIRECTORY, ignore_errors=True)
+
+    def setUp(self):
+        self.out = os.path.join(DIRECTORY, 'catalog.db')
+        with fyyur.app.app_context():
+            fyyur.db.create_all()
+
+    def tearDown(self):
+        with fyyur.app.app_context():
+            fyyur.db.session.remove()
+            fyyur.db.drop_all()
+
+    def write_snapshot(self, *names):
+        with fyyur.app.app_context():
+            db = fyyur.db
+            db.session.add_all([fyyur.Artist(name=name, genres=['Jazz']) for name in names])
+            db.session.commit()
+            return snapshot(db, self.out)
+
+    def read(self, sql):
+        connection = sqlite3.connect(self.out)
+        try:
+            return connection.execute(sql).fetchall()
+        finally:
+            connection.close()
+
+    def test_copies_the_catalog(self):
+        counts = self.write_snapshot('Guns N Petals', 'Matt Quevedo')
+        self.assertEqual(counts['artists'], 2)
+        self.assertEqual(
+            self.read('SELECT name, genres FROM artists ORDER BY id'),
+            [('Guns N Petals', '["Jazz"]'), ('Matt Quevedo', '["Jazz"]')],
+        )
+        self.assertFalse(os.path.exists(self.out + '.tmp'))
+
+    def test_watcher_sees_a_replaced_file(self):
+        self.write_snapshot('Guns N Petals')
+        watcher = SnapshotWatcher(self.out)
+        self.assertFalse(watcher.changed())
+
+        self.write_snapshot('The Wild Sax Band')
+        self.assertTrue(watcher.changed())
+        self.assertFalse(watcher.changed())
+        self.assertEqual(len(self.read('SELECT id FROM artists')), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()